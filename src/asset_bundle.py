@@ -0,0 +1,135 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+from typing import List, Optional, Tuple
+import pygame
+from utils import DEFAULT_CONFIG, field_size_for, load_config
+
+MAGIC = b"PMAB"
+VERSION = 1
+# magic, version, length of the json index
+HEADER = struct.Struct("<4sBI")
+# The pixels of every image start at a multiple of this
+ALIGNMENT = 16
+
+def bundle_path(folder: str, field_size: Tuple[int, int]) -> str:
+    return os.path.join(folder, f"{field_size[0]}x{field_size[1]}.assets")
+
+def sprite_sizes(images: dict, field_size: Tuple[int, int]) -> List[Tuple[str, Optional[tuple], Optional[str]]]:
+    '''(file name, size, convert mode) of every image the game loads, None as size keeps the image as it is.'''
+    half = tuple(size//2 for size in field_size)
+    return ([(images["pacman_icon"], None, None), (images["dot"], half, 'alpha'), (images["wall"], field_size, 'opaque')]
+            + [(images[name], field_size, 'alpha') for name in ("pacman", "fireball", "heart", "ghost_reverse")]
+            + [(name, field_size, 'alpha') for name in images["ghosts"]])
+
+def _entry_key(name: str, size: Optional[tuple]) -> str:
+    return name if size is None else f"{name}@{size[0]}x{size[1]}"
+
+def _aligned(offset: int) -> int:
+    return offset + -offset % ALIGNMENT
+
+
+class AssetBundle:
+    '''Pre-scaled images as raw pixels in one memory-mapped file.
+
+    Surfaces are made with pygame.image.frombuffer straight from the
+    mapping, nothing is decoded or scaled. An image whose original file
+    changed after the bundle was built is not served, so the caller falls
+    back to loading the original.'''
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, index_size = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not an asset bundle or an unsupported version")
+        self._entries = json.loads(self._map[HEADER.size:HEADER.size + index_size])
+        self._data = memoryview(self._map)[_aligned(HEADER.size + index_size):]
+
+    @classmethod
+    def open(cls, folder: str, field_size: Tuple[int, int]) -> Optional['AssetBundle']:
+        '''The bundle built for the field size, None if there is no usable one.'''
+        try:
+            return cls(bundle_path(folder, field_size))
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def surface(self, image_path: str, size: Optional[tuple] = None) -> Optional[pygame.Surface]:
+        entry = self._entries.get(_entry_key(os.path.basename(image_path), size))
+        if entry is None:
+            return None
+        # Bundles can ship without the originals, but an edited original wins
+        try:
+            stat = os.stat(image_path)
+            if [stat.st_size, stat.st_mtime_ns] != entry["source"]:
+                return None
+        except FileNotFoundError:
+            pass
+        width, height = entry["size"]
+        offset = entry["offset"]
+        data = self._data[offset:offset + width*height*len(entry["format"])]
+        return pygame.image.frombuffer(data, (width, height), entry["format"])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def build_bundle(images: dict, field_size: Tuple[int, int], path: str) -> int:
+    '''Scales every image like SpriteCache does and writes the raw pixels into one file. Returns its size.'''
+    entries = {}
+    chunks = []
+    offset = 0
+    for name, size, _ in sprite_sizes(images, field_size):
+        key = _entry_key(name, size)
+        if key in entries:
+            continue
+        source = images["folder"] + name
+        image = pygame.image.load(source)
+        if size is not None:
+            image = pygame.transform.scale(image, size)
+        pixel_format = "RGBA" if image.get_flags() & pygame.SRCALPHA else "RGB"
+        data = pygame.image.tobytes(image, pixel_format)
+        stat = os.stat(source)
+        entries[key] = {"offset": offset, "size": image.get_size(), "format": pixel_format,
+                        "source": [stat.st_size, stat.st_mtime_ns]}
+        chunks.append(data + bytes(_aligned(len(data)) - len(data)))
+        offset += len(chunks[-1])
+
+    index = json.dumps(entries).encode()
+    header = HEADER.pack(MAGIC, VERSION, len(index)) + index
+    header += bytes(_aligned(len(header)) - len(header))
+    # Written under another name first, a running game never maps a half written bundle
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(header)
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(temp_path, path)
+    return len(header) + offset
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pack the game images, scaled for the field size, into one bundle.")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--tile-size", type=int, default=None, help="defaults to tile_size of the config, or the size fitting the maze to the screen")
+    parser.add_argument("--output", default=None, help="bundle file, defaults to the asset_cache folder of the config")
+    args = parser.parse_args(args)
+
+    config = load_config(args.config)
+    field_size = field_size_for(config["screen_width"], config["screen_height"], config["map_width"],
+                                config["map_height"], args.tile_size or config.get("tile_size"))
+    output = args.output
+    if output is None:
+        if config.get("asset_cache") is None:
+            parser.error("the config has no asset_cache folder, give --output")
+        output = bundle_path(config["asset_cache"], field_size)
+
+    size = build_bundle(config["images"], field_size, output)
+    print(f"{output}: {size/1024:.0f} KiB for {field_size[0]}x{field_size[1]} fields")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,74 @@
+from typing import Optional, Tuple
+import pygame
+
+# Convert modes: 'alpha' keeps transparency, 'opaque' is faster to blit, None keeps the file format
+CONVERT_MODES = ('alpha', 'opaque', None)
+
+class SpriteCache:
+    '''Loads, scales and converts every image once and shares the result.
+
+    Cached surfaces are shared by all characters and survive level
+    transitions, so callers must not draw on them. With an AssetBundle set
+    as bundle, images are taken pre-scaled from it and only the ones it
+    lacks are loaded from their files.'''
+    def __init__(self) -> None:
+        self._sprites = {}
+        self.bundle = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,
+            image_path: str,
+            size: Optional[Tuple[int, int]],
+            convert: Optional[str] = 'alpha') -> pygame.Surface:
+        if convert not in CONVERT_MODES:
+            raise ValueError(f"Unknown convert mode: {convert}")
+        # Converting needs a display, without one the image is kept as loaded
+        if pygame.display.get_surface() is None:
+            convert = None
+
+        # A size of None keeps the image at the size of its file
+        key = (image_path, tuple(size) if size is not None else None, convert)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self.hits += 1
+            return sprite
+
+        self.misses += 1
+        sprite = self.bundle.surface(image_path, key[1]) if self.bundle is not None else None
+        if sprite is None:
+            sprite = pygame.image.load(image_path)
+            if key[1] is not None:
+                sprite = pygame.transform.scale(sprite, key[1])
+        if convert == 'alpha':
+            sprite = sprite.convert_alpha()
+        elif convert == 'opaque':
+            sprite = sprite.convert()
+        self._sprites[key] = sprite
+        return sprite
+
+    def stats(self) -> dict:
+        '''Returns hit/miss counters and the number of cached sprites.'''
+        return {"hits": self.hits, "misses": self.misses, "sprites": len(self._sprites)}
+
+    def clear(self) -> None:
+        self._sprites.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Cache shared by the whole game
+sprite_cache = SpriteCache()
+
+def load_game_sprites(images: dict, field_size: Tuple[int, int]) -> dict:
+    '''The images the renderer draws, scaled to field_size, from the config's images section.'''
+    folder = images["folder"]
+    return {
+        "pacman": sprite_cache.get(folder+images["pacman"], field_size),
+        "dot": sprite_cache.get(folder+images["dot"], tuple(size//2 for size in field_size)),
+        "fireball": sprite_cache.get(folder+images["fireball"], field_size),
+        "heart": sprite_cache.get(folder+images["heart"], field_size),
+        "ghosts": [sprite_cache.get(folder+ghost_img, field_size) for ghost_img in images["ghosts"]],
+        "ghost_reverse": sprite_cache.get(folder+images["ghost_reverse"], field_size),
+        "wall": sprite_cache.get(folder+images["wall"], field_size, convert='opaque'),
+    }
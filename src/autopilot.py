@@ -0,0 +1,421 @@
+import heapq
+import random
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from engine import GameState
+from dynamic_maze import changes_between
+from utils import UP, DOWN, LEFT, RIGHT
+
+# Ghosts closer than this (along the maze axes) make a cell dangerous
+DANGER_RADIUS = 2
+# Extra cost of a cell next to a ghost, times how close the ghost is
+GHOST_COST = 10
+# How many cells of the plan are checked for ghosts every tick
+HORIZON = 8
+# Replanning starts this many cells before the first dangerous one
+SPLICE_MARGIN = 3
+# A bonus is chosen over the dot if its path is at most this many steps longer
+BONUS_DETOUR = 6
+# The detour around a ghost joins the plan again this many cells after the danger
+REJOIN_DISTANCE = 2*DANGER_RADIUS + 2
+# Expansions of one detour search, beyond that pacman just steps away from the ghosts
+MAX_EXPANSIONS = 200
+# Ghosts further than this from where replanning starts are ignored by the search
+SEARCH_RADIUS = HORIZON
+# Expansions per tick of the searches for new targets, pacman keeps to its old plan until they finish
+PLAN_EXPANSIONS = 150
+ROUTE_CACHE_SIZE = 64
+
+# Cells within DANGER_RADIUS of a ghost and their distance
+_DANGER_OFFSETS = [(dx, dy, abs(dx) + abs(dy))
+                   for dx in range(-DANGER_RADIUS, DANGER_RADIUS+1)
+                   for dy in range(-DANGER_RADIUS, DANGER_RADIUS+1)
+                   if abs(dx) + abs(dy) <= DANGER_RADIUS]
+_OFFSET_X = np.array([dx for dx, _, _ in _DANGER_OFFSETS])
+_OFFSET_Y = np.array([dy for _, dy, _ in _DANGER_OFFSETS])
+_OFFSET_COST = np.array([GHOST_COST*(DANGER_RADIUS + 1 - distance) for _, _, distance in _DANGER_OFFSETS])
+
+class _Search:
+    '''A* with a manhattan heuristic between flat cell ids that can run a few expansions at a time.
+
+    Neighbours are read from the move mask. costs adds to the price of
+    entering a cell. known maps cells to cached (path, index) shortest
+    routes to the same goal. A known cell is not expanded, its route gives
+    the exact rest of the way, and the best of them is taken once no
+    queued cell can lead to a shorter path.'''
+    __slots__ = ('goal', 'path', 'done', 'expansions', '_move_mask', '_offsets', '_height', '_costs', '_known',
+                 '_distance', '_parent', '_queue', '_best_length', '_best_cell', '_best_route')
+
+    def __init__(self,
+                 move_mask: np.ndarray,
+                 offsets: list,
+                 start: int,
+                 goal: int,
+                 costs: Optional[Dict[int, int]] = None,
+                 known: Optional[dict] = None) -> None:
+        self.goal = goal
+        self.path = None
+        self.done = False
+        self.expansions = 0
+        self._move_mask = move_mask
+        self._offsets = offsets
+        self._height = move_mask.shape[1]
+        self._costs = costs
+        self._known = known
+        self._distance = {start: 0}
+        self._parent = {start: None}
+        self._queue = [(0, 0, start)]
+        # Shortest length seen through a known cell, that cell and its route
+        self._best_length, self._best_cell, self._best_route = None, None, None
+
+    def run(self, expansions: Optional[int] = None) -> bool:
+        '''Expands up to expansions more cells, all that are needed when None.
+
+        True once the search is over, path is then the shortest path or None if there is none.'''
+        if self.done:
+            return True
+        height = self._height
+        goal = self.goal
+        goal_x, goal_y = divmod(goal, height)
+        move_mask, offsets, costs, known = self._move_mask, self._offsets, self._costs, self._known
+        distance, parent, queue = self._distance, self._parent, self._queue
+        best_length = self._best_length
+        expanded = 0
+        while queue and (best_length is None or queue[0][0] < best_length):
+            item = heapq.heappop(queue)
+            _, cell_distance, cell = item
+            if cell_distance > distance[cell]:
+                # Already reached by a cheaper path
+                continue
+            if cell == goal:
+                self.expansions += expanded
+                self._finish(self._walk_back(cell))
+                return True
+            if known is not None and cell in known:
+                route, index = known[cell]
+                length = cell_distance + len(route) - 1 - index
+                if best_length is None or length < best_length:
+                    best_length = self._best_length = length
+                    self._best_cell, self._best_route = cell, known[cell]
+                continue
+            if expanded == expansions:
+                # The next run starts from this cell
+                heapq.heappush(queue, item)
+                self.expansions += expanded
+                return False
+            expanded += 1
+            step_distance = cell_distance + 1
+            for offset in offsets[move_mask.item(cell)]:
+                neighbor = cell + offset
+                new_distance = step_distance if costs is None else step_distance + costs.get(neighbor, 0)
+                if new_distance < distance.get(neighbor, new_distance + 1):
+                    distance[neighbor] = new_distance
+                    parent[neighbor] = cell
+                    x, y = divmod(neighbor, height)
+                    heapq.heappush(queue, (new_distance + abs(x - goal_x) + abs(y - goal_y), new_distance, neighbor))
+        self.expansions += expanded
+        if self._best_cell is None:
+            self._finish(None)
+        else:
+            route, index = self._best_route
+            self._finish(self._walk_back(self._best_cell) + route[index+1:])
+        return True
+
+    def _finish(self, path: Optional[List[int]]) -> None:
+        self.path = path
+        self.done = True
+        # Only the path is needed from now on
+        self._distance = self._parent = self._queue = None
+
+    def _walk_back(self, cell: int) -> List[int]:
+        parent = self._parent
+        path = []
+        while cell is not None:
+            path.append(cell)
+            cell = parent[cell]
+        return path[::-1]
+
+
+class Autopilot:
+    '''Drives pacman along A* paths to the dot or a bonus, avoiding ghosts.
+
+    Shortest paths are cached per goal: every cell of a found path keeps its
+    suffix, so any later start on an earlier path is a cache hit, and later
+    searches finish along a cached suffix once nothing shorter is left.
+    Searches for new targets run PLAN_EXPANSIONS expansions per tick, and
+    pacman keeps to its old plan (or waits, stepping away from close ghosts)
+    until they are done. Pacman follows its current plan and only checks
+    the next HORIZON cells for ghosts. When one comes close, only the
+    affected stretch of the plan is searched again, with a cost on cells
+    near ghosts: from a few cells before the danger to a few cells after
+    it. The rest of the plan is kept. Moves are read from the engine's move
+    mask, and when walls open or close only the cached paths they can
+    change are dropped.'''
+    def __init__(self, rng: random.Random = random) -> None:
+        self._rng = rng
+        self._grid = None
+        self._wall_head = None
+        self._routes = OrderedDict()
+        self._plan = []
+        self._step = 0
+        self._targets = None
+        # Searches for the new targets that are not done yet and the paths found so far
+        self._searches = []
+        self._found = []
+        # Where pacman was and which walls were set when they started
+        self._search_start = None
+        self._search_head = None
+        # A detour already keeps away from ghosts, it is only replaced when one comes right next to it
+        self._detour = False
+        self.replans = 0
+
+    def __call__(self, state: GameState) -> Optional[str]:
+        if state.grid is not self._grid:
+            self._new_level(state)
+        elif state.walls.head is not self._wall_head:
+            self._walls_changed(state)
+
+        pacman = state.pacman.x*self._height + state.pacman.y
+        targets = ((state.dot.x, state.dot.y), (state.fireball.x, state.fireball.y), (state.heart.x, state.heart.y))
+        if not self._follows_plan(pacman):
+            self._plan = []
+        if targets != self._targets or not (self._plan or self._searches):
+            self._targets = targets
+            self._start_plan(pacman)
+        if self._searches:
+            self._continue_plan(pacman)
+
+        # Calm ghosts are eaten on contact, the others have to be avoided
+        if state.ghost_mode != 'calm' and state.ghosts.count:
+            ghost_x, ghost_y = state.ghosts.x[:state.ghosts.count], state.ghosts.y[:state.ghosts.count]
+            if self._step + 1 < len(self._plan):
+                danger = self._first_danger(ghost_x, ghost_y, 1 if self._detour else DANGER_RADIUS)
+                if danger is not None:
+                    splice = max(self._step, danger - SPLICE_MARGIN)
+                    costs = self._ghost_costs(ghost_x, ghost_y, self._plan[splice])
+                    self._replan(splice, danger, costs)
+                    if self._plan is None:
+                        return self._escape(pacman, costs)
+            elif self._searches and self._ghosts_near(ghost_x, ghost_y, [pacman], DANGER_RADIUS):
+                # Waiting for the searches, pacman only moves to get away from ghosts
+                costs = self._ghost_costs(ghost_x, ghost_y, pacman)
+                if pacman in costs:
+                    return self._escape(pacman, costs)
+
+        if self._step + 1 >= len(self._plan):
+            return None
+        return self._direction(self._plan[self._step], self._plan[self._step + 1])
+
+    def _new_level(self, state: GameState) -> None:
+        self._grid = state.grid
+        # The engine changes the move mask in place when walls open or close
+        self._move_mask = state.move_mask
+        self._width, self._height = state.grid.shape
+        # Flat id offset of a step in every direction
+        self._steps = ((UP, -1, 'up'), (DOWN, 1, 'down'), (LEFT, -self._height, 'left'), (RIGHT, self._height, 'right'))
+        # Offsets of the steps every move mask value allows
+        self._offsets = [tuple(offset for bit, offset, _ in self._steps if mask & bit)
+                         for mask in range((UP | DOWN | LEFT | RIGHT) + 1)]
+        self._wall_head = state.walls.head
+        self._routes.clear()
+        self._plan = []
+        self._targets = None
+        self._searches = []
+        self._found = []
+
+    def _walls_changed(self, state: GameState) -> None:
+        '''Drops the cached paths the toggled cells change.'''
+        undo, redo = changes_between(self._wall_head, state.walls.head)
+        height = self._height
+        for x, y in set(undo) | set(redo):
+            cell = x*height + y
+            for goal, routes in self._routes.items():
+                if state.grid.item(x, y) == 0:
+                    # A path using the opened cell is at least as long as the manhattan distances
+                    # through it, routes that are not longer than that stay shortest
+                    goal_x, goal_y = divmod(goal, height)
+                    through = abs(x - goal_x) + abs(y - goal_y)
+                    stale = [start for start, (path, index) in routes.items()
+                             if through + abs(start//height - x) + abs(start % height - y) < len(path) - 1 - index]
+                else:
+                    # A closed cell only breaks the routes that pass it
+                    positions = {}
+                    for path, _ in routes.values():
+                        if id(path) not in positions:
+                            positions[id(path)] = path.index(cell) if cell in path else -1
+                    stale = [start for start, (path, index) in routes.items() if index <= positions[id(path)]]
+                for start in stale:
+                    del routes[start]
+        self._wall_head = state.walls.head
+        # The plan is chosen again, mostly from the cached paths, searches already running go on
+        self._plan = []
+
+    def _neighbors(self, cell: int) -> List[int]:
+        return [cell + offset for offset in self._offsets[self._move_mask.item(cell)]]
+
+    def _direction(self, cell: int, next_cell: int) -> Optional[str]:
+        for _, offset, action in self._steps:
+            if next_cell - cell == offset:
+                return action
+        return None
+
+    def _follows_plan(self, pacman: int) -> bool:
+        '''Moves the plan forward to pacman's cell, False when pacman left the plan.'''
+        if not self._plan:
+            return False
+        if self._plan[self._step] == pacman:
+            return True
+        if self._step + 1 < len(self._plan) and self._plan[self._step + 1] == pacman:
+            self._step += 1
+            return True
+        return False
+
+    def _start_plan(self, pacman: int) -> None:
+        '''Takes the cached paths to the targets and starts searches for the others.'''
+        self._search_start, self._search_head = pacman, self._wall_head
+        self._searches, self._found = [], []
+        for target, (x, y) in enumerate(self._targets):
+            if x < 0:
+                continue
+            routes = self._goal_routes(x*self._height + y)
+            if pacman in routes:
+                path, index = routes[pacman]
+                self._found.append((target, path[index:]))
+            else:
+                self._searches.append((target, _Search(self._move_mask, self._offsets, pacman, x*self._height + y,
+                                                       known=routes)))
+        if not self._searches:
+            self._choose_plan(pacman)
+
+    def _continue_plan(self, pacman: int) -> None:
+        '''Runs the searches for PLAN_EXPANSIONS expansions and chooses the plan once all are done.'''
+        budget = PLAN_EXPANSIONS
+        while self._searches:
+            target, search = self._searches[-1]
+            expansions = search.expansions
+            if not search.run(budget):
+                return
+            budget -= search.expansions - expansions
+            self._searches.pop()
+            if search.path is None:
+                continue
+            if self._search_head is self._wall_head:
+                self._remember(search.goal, search.path)
+            self._found.append((target, search.path))
+        self._choose_plan(pacman)
+
+    def _choose_plan(self, pacman: int) -> None:
+        '''Follows the shortest path to the dot, or to a bonus that is not much further away.'''
+        best_plan, best_cost = [], None
+        for target, path in self._found:
+            cost = len(path) - (BONUS_DETOUR if target else 0)
+            if best_cost is None or cost < best_cost:
+                best_plan, best_cost = path, cost
+        if pacman != self._search_start and pacman in best_plan:
+            # Pacman went on along its old plan meanwhile and is on the new one
+            best_plan = best_plan[best_plan.index(pacman):]
+        elif pacman != self._search_start or (self._search_head is not self._wall_head and not self._passable(best_plan)):
+            # Found from a cell pacman left or through a wall that closed since
+            self._start_plan(pacman)
+            return
+        self._plan = best_plan
+        self._step = 0
+        self._detour = False
+
+    def _passable(self, path: List[int]) -> bool:
+        offsets, move_mask = self._offsets, self._move_mask
+        return all(next_cell - cell in offsets[move_mask.item(cell)] for cell, next_cell in zip(path, path[1:]))
+
+    def _goal_routes(self, goal: int) -> dict:
+        '''The cached routes to goal, by start cell.'''
+        routes = self._routes.get(goal)
+        if routes is None:
+            routes = self._routes[goal] = {}
+            if len(self._routes) > ROUTE_CACHE_SIZE:
+                self._routes.popitem(last=False)
+        else:
+            self._routes.move_to_end(goal)
+        return routes
+
+    def _remember(self, goal: int, path: List[int]) -> None:
+        # Every suffix of a shortest path is a shortest path to the same goal
+        routes = self._goal_routes(goal)
+        for index, cell in enumerate(path):
+            routes.setdefault(cell, (path, index))
+
+    def path(self, start: int, goal: int) -> Optional[List[int]]:
+        '''Cached shortest path between two flat cell ids, both ends included, searched in full if it is not cached.'''
+        routes = self._goal_routes(goal)
+        if start in routes:
+            path, index = routes[start]
+            return path[index:]
+        search = _Search(self._move_mask, self._offsets, start, goal, known=routes)
+        search.run()
+        if search.path is not None:
+            self._remember(goal, search.path)
+        return search.path
+
+    def _ghosts_near(self, ghost_x: np.ndarray, ghost_y: np.ndarray, cells: List[int], margin: int) -> List[int]:
+        '''Flat ids of the ghosts inside the bounding box of cells grown by margin.'''
+        xs = [cell // self._height for cell in cells]
+        ys = [cell % self._height for cell in cells]
+        near = ((ghost_x >= min(xs) - margin) & (ghost_x <= max(xs) + margin) &
+                (ghost_y >= min(ys) - margin) & (ghost_y <= max(ys) + margin))
+        return (ghost_x[near]*self._height + ghost_y[near]).tolist()
+
+    def _first_danger(self, ghost_x: np.ndarray, ghost_y: np.ndarray, radius: int) -> Optional[int]:
+        '''Index of the first planned cell within radius of a ghost, looking HORIZON cells ahead.'''
+        ahead = self._plan[self._step + 1:self._step + 1 + HORIZON]
+        if not ahead:
+            return None
+        ghosts = set(self._ghosts_near(ghost_x, ghost_y, ahead, radius))
+        if not ghosts:
+            return None
+        height = self._height
+        for index, cell in enumerate(ahead, self._step + 1):
+            x, y = divmod(cell, height)
+            for dx, dy, distance in _DANGER_OFFSETS:
+                if distance <= radius and 0 <= y + dy < height and (x + dx)*height + y + dy in ghosts:
+                    return index
+        return None
+
+    def _ghost_costs(self, ghost_x: np.ndarray, ghost_y: np.ndarray, center: int) -> Dict[int, int]:
+        '''Extra cost of the cells within SEARCH_RADIUS of center that are near ghosts.'''
+        height = self._height
+        center_x, center_y = divmod(center, height)
+        left, top = max(center_x - SEARCH_RADIUS, 0), max(center_y - SEARCH_RADIUS, 0)
+        right, bottom = min(center_x + SEARCH_RADIUS + 1, self._width), min(center_y + SEARCH_RADIUS + 1, height)
+        near = ((ghost_x >= left - DANGER_RADIUS) & (ghost_x < right + DANGER_RADIUS) &
+                (ghost_y >= top - DANGER_RADIUS) & (ghost_y < bottom + DANGER_RADIUS))
+        # Every ghost against every offset at once, cells near several ghosts keep the highest cost
+        x = (ghost_x[near, None] - left + _OFFSET_X).ravel()
+        y = (ghost_y[near, None] - top + _OFFSET_Y).ravel()
+        cost = np.broadcast_to(_OFFSET_COST, (int(near.sum()), len(_OFFSET_COST))).ravel()
+        inside = (x >= 0) & (x < right - left) & (y >= 0) & (y < bottom - top)
+        window = np.zeros((right - left, bottom - top), dtype=np.int64)
+        np.maximum.at(window, (x[inside], y[inside]), cost[inside])
+        xs, ys = np.nonzero(window)
+        return dict(zip(((xs + left)*height + ys + top).tolist(), window[xs, ys].tolist()))
+
+    def _replan(self, splice: int, danger: int, costs: Dict[int, int]) -> None:
+        '''Searches a detour with costs near ghosts from the splice index to a little after the danger.'''
+        self.replans += 1
+        rejoin = min(danger + REJOIN_DISTANCE, len(self._plan) - 1)
+        search = _Search(self._move_mask, self._offsets, self._plan[splice], self._plan[rejoin], costs)
+        detour = search.path if search.run(MAX_EXPANSIONS) else None
+        if detour is None:
+            self._plan = None
+            return
+        self._plan = self._plan[:splice] + detour + self._plan[rejoin+1:]
+        self._detour = True
+
+    def _escape(self, pacman: int, costs: Dict[int, int]) -> Optional[str]:
+        '''Steps to the neighbouring cell furthest from the ghosts, a random one among equals.'''
+        self._plan = []
+        neighbors = self._neighbors(pacman)
+        if not neighbors:
+            return None
+        lowest = min(costs.get(neighbor, 0) for neighbor in neighbors)
+        best = self._rng.choice([neighbor for neighbor in neighbors if costs.get(neighbor, 0) == lowest])
+        return self._direction(pacman, best)
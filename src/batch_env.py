@@ -0,0 +1,303 @@
+import random
+from typing import Dict, Optional, Tuple
+import numpy as np
+from maze_generator import generate_maze
+from engine import ACTIONS, GHOST_SPAWN_DISTANCE, MAX_LEVEL
+from utils import UP, DOWN, LEFT, RIGHT, build_move_mask
+
+# Action codes: 0 stands still, 1-4 follow the order of engine.ACTIONS
+MOVES = np.array([(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)])
+MOVE_BITS = np.array([0, LEFT, RIGHT, UP, DOWN], dtype=np.uint8)
+ACTION_CODES = {action: code+1 for code, action in enumerate(ACTIONS)}
+
+# Ghost modes stored as small integers
+HUNT, CALM, FEAR = 0, 1, 2
+GHOST_MODES = ('hunt', 'calm', 'fear')
+
+# Ghost directions in the order used by Ghost.make_move: up, down, left, right
+GHOST_MOVES = np.array([(0, -1), (0, 1), (-1, 0), (1, 0)])
+GHOST_BITS = np.array([UP, DOWN, LEFT, RIGHT], dtype=np.uint8)
+
+class BatchPacmanEnv:
+    '''N independent games stored as stacked numpy arrays and advanced together.
+
+    Follows the rules of engine.Engine, except that ghosts keep the direction
+    heuristic of Ghost.make_move: a BFS per game and tick would cost more
+    than the whole step. Free cells for spawning are found by spawn_tries
+    rounds of random draws instead of the engine's exact scan, so in a
+    crowded maze a bonus or ghost may be skipped where the engine would
+    still have found a cell. Finished games (death or win) are restarted
+    from the first level at the beginning of the next step.'''
+    def __init__(self,
+                 num_games: int,
+                 map_width: int,
+                 map_height: int,
+                 wall_density: float,
+                 fireball_time: int,
+                 heart_time: int,
+                 max_score: int,
+                 ghost_sprites: int = 1,
+                 mazes_per_level: int = 8,
+                 spawn_tries: int = 64) -> None:
+
+        self.num_games = num_games
+        self.map_width = map_width
+        self.map_height = map_height
+        self.wall_density = wall_density
+        self.fireball_time = fireball_time
+        self.heart_time = heart_time
+        self.max_score = max_score
+        self.ghost_sprites = ghost_sprites
+        # Mazes are drawn from a small per-level bank, generating one per reset is too slow
+        self.mazes_per_level = mazes_per_level
+        # Rejection rounds looking for a free spawn cell before the spawn is given up
+        self.spawn_tries = spawn_tries
+
+        self.rng = np.random.default_rng()
+        self._maze_rng = random.Random()
+        self._maze_bank = {}
+
+    def reset(self, seed: Optional[int] = None) -> 'BatchPacmanEnv':
+        '''Starts all games from the first level.'''
+        n = self.num_games
+        self.rng = np.random.default_rng(seed)
+        self._maze_rng = random.Random(seed)
+        self._maze_bank = {}
+
+        self.grid = np.ones((n, self.map_width, self.map_height), dtype=np.uint8)
+        self.move_mask = np.zeros((n, self.map_width, self.map_height), dtype=np.uint8)
+        self.pacman = np.zeros((n, 2), dtype=np.int64)
+        self.dot = np.zeros((n, 2), dtype=np.int64)
+        self.fireball = np.full((n, 2), -1, dtype=np.int64)
+        self.heart = np.full((n, 2), -1, dtype=np.int64)
+        # Every eaten dot spawns a ghost, so a level never has more than max_score of them
+        self.ghosts = np.full((n, self.max_score, 2), -1, dtype=np.int64)
+        self.ghost_alive = np.zeros((n, self.max_score), dtype=bool)
+        self.ghost_sprite = np.zeros((n, self.max_score), dtype=np.int64)
+        self.ghost_count = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.level = np.ones(n, dtype=np.int64)
+        self.fireball_counter = np.zeros(n, dtype=np.int64)
+        self.heart_counter = np.zeros(n, dtype=np.int64)
+        self.ghost_mode = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.tick = np.zeros(n, dtype=np.int64)
+
+        self._start_level(np.arange(n))
+        return self
+
+    def _mazes(self, level: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''Grids and move masks of the maze bank of a level.'''
+        if level not in self._maze_bank:
+            grids = np.stack([
+                generate_maze(self.map_width, self.map_height, self.wall_density, 0.1, level/10, self._maze_rng)
+                for _ in range(self.mazes_per_level)
+            ]).astype(np.uint8)
+            self._maze_bank[level] = (grids, np.stack([build_move_mask(grid) for grid in grids]))
+        return self._maze_bank[level]
+
+    def _start_level(self, games: np.ndarray) -> None:
+        for level in np.unique(self.level[games]):
+            level_games = games[self.level[games] == level]
+            grids, move_masks = self._mazes(int(level))
+            chosen = self.rng.integers(len(grids), size=len(level_games))
+            self.grid[level_games] = grids[chosen]
+            self.move_mask[level_games] = move_masks[chosen]
+
+        # Characters of the previous level are cleared first, so they do not block the new cells
+        self.dot[games] = -1
+        self.fireball[games] = -1
+        self.heart[games] = -1
+        self.ghosts[games] = -1
+        self.ghost_alive[games] = False
+        self.ghost_count[games] = 0
+        self.pacman[games] = self._random_open_cells(games)
+        self._spawn_dots(games)
+        cells = self._random_free_cells(games)
+        placed = cells[:, 0] >= 0
+        self._add_ghosts(games[placed], cells[placed])
+        self.score[games] = 0
+        self.fireball_counter[games] = self.fireball_time
+        self.heart_counter[games] = self.heart_time
+
+    def _random_open_cells(self, games: np.ndarray) -> np.ndarray:
+        '''Vectorized version of Character._initialize_field.'''
+        cells = np.empty((len(games), 2), dtype=np.int64)
+        pending = np.arange(len(games))
+        while len(pending):
+            x = self.rng.integers(self.map_width, size=len(pending))
+            y = self.rng.integers(self.map_height, size=len(pending))
+            found = self.grid[games[pending], x, y] == 0
+            cells[pending[found], 0] = x[found]
+            cells[pending[found], 1] = y[found]
+            pending = pending[~found]
+        return cells
+
+    def _taken(self, games: np.ndarray, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        '''Whether pacman, the dot, a bonus or a living ghost stands on the cell of each game.'''
+        cells = np.stack([x, y], axis=1)
+        taken = np.zeros(len(games), dtype=bool)
+        for character in (self.pacman, self.dot, self.fireball, self.heart):
+            taken |= np.all(character[games] == cells, axis=1)
+        on_ghost = np.all(self.ghosts[games] == cells[:, None], axis=2) & self.ghost_alive[games]
+        return taken | on_ghost.any(axis=1)
+
+    def _random_free_cells(self, games: np.ndarray, away_from: Optional[np.ndarray] = None) -> np.ndarray:
+        '''Vectorized SpawnIndex.sample: open cells no character stands on, -1 where none was found.
+
+        With away_from the cell of a game must be more than GHOST_SPAWN_DISTANCE
+        cells away from its row of away_from along both axes.'''
+        cells = np.full((len(games), 2), -1, dtype=np.int64)
+        pending = np.arange(len(games))
+        for _ in range(self.spawn_tries):
+            if not len(pending):
+                break
+            x = self.rng.integers(self.map_width, size=len(pending))
+            y = self.rng.integers(self.map_height, size=len(pending))
+            found = (self.grid[games[pending], x, y] == 0) & ~self._taken(games[pending], x, y)
+            if away_from is not None:
+                found &= ((np.abs(x - away_from[pending, 0]) > GHOST_SPAWN_DISTANCE)
+                          & (np.abs(y - away_from[pending, 1]) > GHOST_SPAWN_DISTANCE))
+            cells[pending[found], 0] = x[found]
+            cells[pending[found], 1] = y[found]
+            pending = pending[~found]
+        return cells
+
+    def _spawn_dots(self, games: np.ndarray) -> None:
+        '''Moves the dot to a free cell, any open cell when no free one is found: it must always exist.'''
+        self.dot[games] = -1
+        cells = self._random_free_cells(games)
+        missing = cells[:, 0] < 0
+        cells[missing] = self._random_open_cells(games[missing])
+        self.dot[games] = cells
+
+    def _spawn_bonus(self, bonus: np.ndarray, games: np.ndarray) -> None:
+        '''Moves the bonus to a free cell, it stays where it is when none is found.'''
+        cells = self._random_free_cells(games)
+        placed = cells[:, 0] >= 0
+        bonus[games[placed]] = cells[placed]
+
+    def _add_ghosts(self, games: np.ndarray, cells: np.ndarray) -> None:
+        slots = self.ghost_count[games]
+        self.ghosts[games, slots] = cells
+        self.ghost_alive[games, slots] = True
+        self.ghost_sprite[games, slots] = self.rng.integers(self.ghost_sprites, size=len(games))
+        self.ghost_count[games] += 1
+
+    def _spawn_far_ghosts(self, games: np.ndarray) -> None:
+        '''Adds a ghost away from pacman, no ghost appears where no such free cell is found.'''
+        cells = self._random_free_cells(games, self.pacman[games])
+        placed = cells[:, 0] >= 0
+        self._add_ghosts(games[placed], cells[placed])
+
+    def step(self, actions: np.ndarray) -> Dict[str, np.ndarray]:
+        '''Plays one tick in every game. actions holds one code per game (see MOVES).
+
+        Returns per-game event arrays named like the events of Engine.step.'''
+        finished = np.flatnonzero(self.done)
+        if len(finished):
+            self.level[finished] = 1
+            self.tick[finished] = 0
+            self.done[finished] = False
+            self._start_level(finished)
+
+        n = self.num_games
+        games = np.arange(n)
+        events = {name: np.zeros(n, dtype=bool) for name in ('dot', 'level', 'win', 'fireball', 'heart', 'death')}
+        events['ghost_eaten'] = np.zeros(n, dtype=np.int64)
+        self.tick += 1
+
+        # Ghost behaviour mode
+        self.heart_counter[self.fireball_counter == 0] += self.heart_time
+        self.fireball_counter[self.heart_counter == 0] += self.fireball_time
+        self.fireball_counter += 1
+        self.heart_counter += 1
+        self.ghost_mode[:] = HUNT
+        self.ghost_mode[self.fireball_counter < self.fireball_time] = CALM
+        self.ghost_mode[self.heart_counter < self.heart_time] = FEAR
+
+        # Pacman behaviour
+        actions = np.asarray(actions)
+        movable = (self.move_mask[games, self.pacman[:, 0], self.pacman[:, 1]] & MOVE_BITS[actions]) != 0
+        self.pacman[movable] += MOVES[actions[movable]]
+
+        # Dot eating
+        eaten = np.all(self.pacman == self.dot, axis=1)
+        events['dot'] = eaten
+        self.score[eaten] += 1
+        completed = eaten & (self.score == self.max_score)
+        events['win'] = completed & (self.level == MAX_LEVEL)
+        events['level'] = completed & ~events['win']
+        self.done |= events['win']
+
+        leveled = np.flatnonzero(events['level'])
+        if len(leveled):
+            self.level[leveled] += 1
+            self._start_level(leveled)
+
+        # Games that changed level or finished skip the rest of the tick
+        active = ~completed
+        fed = np.flatnonzero(eaten & active)
+        if len(fed):
+            self._spawn_dots(fed)
+            self._spawn_bonus(self.fireball, fed[self.rng.integers(10, size=len(fed)) == 0])
+            self._spawn_bonus(self.heart, fed[self.rng.integers(5, size=len(fed)) == 0])
+            self._spawn_far_ghosts(fed)
+
+        # Bonus catching
+        caught = active & np.all(self.pacman == self.fireball, axis=1)
+        events['fireball'] = caught
+        self.fireball_counter[caught] = 0
+        self.fireball[caught] = -1
+        caught = active & np.all(self.pacman == self.heart, axis=1)
+        events['heart'] = caught
+        self.heart_counter[caught] = 0
+        self.heart[caught] = -1
+
+        # Ghost collisions
+        self._ghost_collisions(active, events)
+
+        # Ghost behaviour, weighted random choice like Ghost.make_move
+        moving = self.ghost_alive & (active & ~self.done)[:, None]
+        self._move_ghosts(moving)
+
+        # Ghosts that stepped onto pacman catch him too
+        self._ghost_collisions(active & ~self.done, events)
+
+        return events
+
+    def _ghost_collisions(self, active: np.ndarray, events: Dict[str, np.ndarray]) -> None:
+        touching = self.ghost_alive & np.all(self.ghosts == self.pacman[:, None, :], axis=2) & active[:, None]
+        hit = touching.any(axis=1)
+        calm = self.ghost_mode == CALM
+        events['death'] |= hit & ~calm
+        self.done |= events['death']
+        eaten_ghosts = touching & calm[:, None]
+        events['ghost_eaten'] += eaten_ghosts.sum(axis=1)
+        self.ghost_alive &= ~eaten_ghosts
+
+    def _move_ghosts(self, moving: np.ndarray) -> None:
+        gx, gy = self.ghosts[..., 0], self.ghosts[..., 1]
+        px, py = self.pacman[:, 0, None], self.pacman[:, 1, None]
+        games = np.arange(self.num_games)[:, None]
+
+        # Removed ghosts sit at (-1, -1), which still indexes a real cell but they are not moving
+        possible = ((self.move_mask[games, gx, gy][..., None] & GHOST_BITS) != 0) & moving[..., None]
+
+        # Directions (up, down, left, right) that lead towards pacman
+        towards = np.stack([py < gy, py > gy, px < gx, px > gx], axis=-1)
+        away = np.stack([py > gy, py < gy, px > gx, px < gx], axis=-1)
+        mode = self.ghost_mode[:, None, None]
+        preferred = np.where(mode == HUNT, towards, np.where(mode == FEAR, away, False))
+        weights = (1 + 2*preferred) * possible
+
+        cumulative = np.cumsum(weights, axis=-1)
+        total = cumulative[..., -1]
+        pick = self.rng.random(total.shape) * total
+        direction = np.argmax(cumulative > pick[..., None], axis=-1)
+
+        can_move = total > 0
+        self.ghosts[can_move] += GHOST_MOVES[direction[can_move]]
+
+    def ghost_mode_names(self) -> list:
+        return [GHOST_MODES[mode] for mode in self.ghost_mode]
@@ -0,0 +1,236 @@
+import os
+# Frames are rendered without a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pygame
+from maze_generator import Maze, generate_maze
+from characters import Pacman, Ghost, GhostGroup
+from assets import load_game_sprites, sprite_cache
+from asset_bundle import AssetBundle, build_bundle, bundle_path, sprite_sizes
+from engine import Engine, MAX_LEVEL
+from ghost_ai import GhostPlanner
+from renderer import Renderer
+from utils import MOVE_BITS, MOVE_STEPS, build_move_mask, engine_config_from, field_size_for, load_config
+
+MAZE_SIZES = [(60, 30), (200, 100), (500, 500), (1000, 1000)]
+QUICK_MAZE_SIZES = [(60, 30), (200, 100)]
+# (wall_density, fragmentation) pairs, the fragmentation of levels 1, 5 and 10
+MAZE_PARAMETERS = [(0.2, 0.1), (0.2, 0.5), (0.4, 1.0)]
+GHOST_COUNTS = [1, 10, 100, 1000, 10000]
+QUICK_GHOST_COUNTS = [1, 10, 100, 1000]
+
+def measure(function: Callable[[], None], min_time: float = 0.5, max_runs: int = 100) -> dict:
+    '''Runs function until min_time has passed (at least once) and returns timing statistics in seconds.'''
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_runs and (not times or time.perf_counter() - start < min_time):
+        begin = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - begin)
+    return {"median": statistics.median(times), "min": min(times), "runs": len(times)}
+
+
+def bench_mazes(sizes: List[tuple]) -> Dict[str, dict]:
+    results = {}
+    for map_width, map_height in sizes:
+        for wall_density, fragmentation in MAZE_PARAMETERS:
+            name = f"{map_width}x{map_height}_d{wall_density}_f{fragmentation}"
+            rng = random.Random(0)
+            results[f"maze.Maze.generate_maze.{name}"] = measure(
+                lambda: Maze(map_width, map_height, wall_density, fragmentation, rng).generate_maze())
+            results[f"maze.generate_maze.{name}"] = measure(
+                lambda: generate_maze(map_width, map_height, wall_density, 0.1, fragmentation, rng))
+    return results
+
+def bench_walls(sizes: List[tuple], mutations: int = 100) -> Dict[str, dict]:
+    '''Opening and closing walls of dynamic mazes, including the move mask, spawn index and ghost planner updates.'''
+    results = {}
+    for map_width, map_height in sizes:
+        engine = Engine(map_width, map_height, 0.2, 100, 100, 10, dynamic_walls=True)
+        engine.reset(0)
+
+        def move_walls():
+            for _ in range(mutations):
+                engine.move_wall()
+        results[f"walls.move_wall.{map_width}x{map_height}.x{mutations}"] = measure(move_walls)
+    return results
+
+def random_walk(move_mask: np.ndarray, start: tuple, steps: int, rng: random.Random) -> List[tuple]:
+    '''Cells visited by random moves from start, like pacman wandering the maze.'''
+    x, y = start
+    cells = []
+    for _ in range(steps):
+        moves = [MOVE_STEPS[action] for action, bit in MOVE_BITS.items() if move_mask[x, y] & bit]
+        if moves:
+            dx, dy = rng.choice(moves)
+            x, y = x + dx, y + dy
+        cells.append((x, y))
+    return cells
+
+def bench_ghosts(counts: List[int], map_width: int = 60, map_height: int = 30) -> Dict[str, dict]:
+    results = {}
+    grid = generate_maze(map_width, map_height, 0.2, 0.1, 0.5, random.Random(0))
+    move_mask = build_move_mask(grid)
+    open_cells = np.argwhere(grid == 0)
+    # Pacman moves between runs, so the planner's distance fields are mostly new like in a game
+    targets = random_walk(move_mask, tuple(open_cells[0].tolist()), 1000, random.Random(0))
+    for count in counts:
+        rng = random.Random(0)
+        cells = open_cells[rng.choices(range(len(open_cells)), k=count)]
+        for mode in ('hunt', 'calm', 'fear'):
+            ghosts = [Ghost(grid, None, map_width, map_height, None, rng, position=tuple(cell), move_mask=move_mask)
+                      for cell in cells]
+            walk = itertools.count()
+            def move_ghosts():
+                target = targets[next(walk) % len(targets)]
+                for ghost in ghosts:
+                    ghost.make_move(target[0], target[1], mode)
+            results[f"ghosts.Ghost.make_move.{count}.{mode}"] = measure(move_ghosts)
+
+            group = GhostGroup()
+            for x, y in cells:
+                group.add(x, y, 0)
+            planner = GhostPlanner(grid)
+            np_rng = np.random.default_rng(0)
+            walk = itertools.count()
+            def move_group():
+                target = targets[next(walk) % len(targets)]
+                group.make_move(target[0], target[1], mode, planner, np_rng)
+            results[f"ghosts.GhostGroup.make_move.{count}.{mode}"] = measure(move_group)
+    return results
+
+def bench_characters(config: dict, field_size: tuple) -> Dict[str, dict]:
+    images = config["images"]
+    image_path = images["folder"] + images["pacman"]
+    grid = generate_maze(config["map_width"], config["map_height"], 0.2, 0.1, 0.1, random.Random(0))
+    rng = random.Random(0)
+
+    def construct(cold: bool):
+        if cold:
+            sprite_cache.clear()
+        Pacman(grid, field_size, config["map_width"], config["map_height"], image_path, rng)
+
+    return {
+        "characters.Pacman.cold_image": measure(lambda: construct(True)),
+        "characters.Pacman.cached_image": measure(lambda: construct(False)),
+        "characters.Pacman.headless": measure(
+            lambda: Pacman(grid, None, config["map_width"], config["map_height"], None, rng)),
+    }
+
+def bench_assets(config: dict, field_size: tuple) -> Dict[str, dict]:
+    images = config["images"]
+    results = {}
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as folder:
+        results["assets.build_bundle"] = measure(
+            lambda: build_bundle(images, field_size, bundle_path(folder, field_size)), max_runs=10)
+        # Every image of the game loaded cold, as at startup
+        for source, bundle in (("images", None), ("bundle", AssetBundle.open(folder, field_size))):
+            def load_all():
+                sprite_cache.clear()
+                sprite_cache.bundle = bundle
+                for name, size, convert in sprite_sizes(images, field_size):
+                    sprite_cache.get(images["folder"] + name, size, convert)
+            results[f"assets.load.{source}"] = measure(load_all)
+        sprite_cache.bundle = None
+    return results
+
+def bench_render(config: dict, screen: pygame.Surface, field_size: tuple, ticks: int = 200) -> Dict[str, dict]:
+    renderer = Renderer(screen, field_size, load_game_sprites(config["images"], field_size), config["max_score"], MAX_LEVEL)
+
+    engine = Engine(**engine_config_from(config, {"dynamic_walls": False}))
+    engine.reset(0)
+    rng = random.Random(0)
+    snapshots = []
+    for _ in range(ticks):
+        state, _ = engine.step(rng.choice(('left', 'right', 'up', 'down')))
+        if not state.running:
+            engine.reset(rng.getrandbits(32))
+        snapshots.append(engine.snapshot())
+    # step() changes its state in place, restoring gives every tick a state of its own to draw
+    states = [engine.restore(snapshot) for snapshot in snapshots]
+
+    def draw_full():
+        # Forgetting the grid makes the renderer build the level background again
+        renderer._grid = None
+        renderer.draw(states[-1])
+
+    frames = itertools.count()
+    return {
+        "render.frame.full": measure(draw_full),
+        "render.frame.incremental": measure(lambda: renderer.draw(states[next(frames) % len(states)])),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    '''Names of the benchmarks whose median got slower than the baseline by more than threshold.'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result["median"] / baseline[name]["median"]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{name:60s} {baseline[name]['median']*1e3:10.3f}ms -> {result['median']*1e3:10.3f}ms {ratio:6.2f}x {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time maze generation, wall changes, ghost moves, character creation, asset loading and rendering.")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results as json")
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline")
+    parser.add_argument("--quick", action="store_true", help="skip the largest mazes and ghost counts")
+    parser.add_argument("--only", default=None, help="run only benchmarks whose group starts with this")
+    args = parser.parse_args(args)
+
+    config = load_config()
+    pygame.init()
+    screen = pygame.display.set_mode((config["screen_width"], config["screen_height"]))
+    field_size = field_size_for(config["screen_width"], config["screen_height"], config["map_width"], config["map_height"])
+
+    groups = {
+        "maze": lambda: bench_mazes(QUICK_MAZE_SIZES if args.quick else MAZE_SIZES),
+        "walls": lambda: bench_walls(QUICK_MAZE_SIZES if args.quick else MAZE_SIZES),
+        "ghosts": lambda: bench_ghosts(QUICK_GHOST_COUNTS if args.quick else GHOST_COUNTS),
+        "characters": lambda: bench_characters(config, field_size),
+        "assets": lambda: bench_assets(config, field_size),
+        "render": lambda: bench_render(config, screen, field_size),
+    }
+    results = {}
+    for group, run in groups.items():
+        if args.only is None or group.startswith(args.only):
+            print(f"Running {group} benchmarks...", file=sys.stderr)
+            results.update(run())
+    pygame.quit()
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {"python": platform.python_version(), "platform": platform.platform(), "time": time.time()},
+            "results": results,
+        }, f, indent=2)
+
+    if args.baseline is None:
+        for name, result in results.items():
+            print(f"{name:60s} {result['median']*1e3:10.3f}ms")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    print(f"{len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
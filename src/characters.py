@@ -1,37 +1,57 @@
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import Optional, Tuple
 import random
-import pygame
 import numpy as np
 from utils import *
 
+def load_scaled_image(image_path: str, size: Tuple[int, int], convert: Optional[str] = 'alpha'):
+    '''Returns the scaled image from the shared sprite cache.
+
+    Pygame is imported here so that the game rules can run headless.'''
+    from assets import sprite_cache
+    return sprite_cache.get(image_path, size, convert)
+
 class Character(ABC):
     '''Base class for all characters in the game.'''
     def __init__(self,
                  grid: np.ndarray,
-                 field_size: Tuple[int, int],
+                 field_size: Optional[Tuple[int, int]],
                  map_width: int,
                  map_height: int,
-                 image_path: str) -> None:
+                 image_path: Optional[str],
+                 rng=random,
+                 position: Optional[Tuple[int, int]] = None,
+                 move_mask: Optional[np.ndarray] = None) -> None:
         
         self._grid = grid
         self._field_size = field_size
         self._map_width = map_width
         self._map_height = map_height
         self._image_path = image_path
+        self._rng = rng
+        # Shared per level by the engine, built on first use for standalone characters
+        self._move_mask = move_mask
 
-        self.image = self._load_image()
-        self.x, self.y = self._initialize_field()
+        # Headless characters (image_path=None) never touch pygame
+        self.image = self._load_image() if image_path is not None else None
+        # The engine picks cells from its SpawnIndex, standalone characters look for one themselves
+        self.x, self.y = position if position is not None else self._initialize_field()
 
 
     @abstractmethod
     def _load_image(self):
         '''Loads and scales image.'''
 
+    def _possible_moves(self) -> int:
+        '''Move mask bits (see utils.MOVE_BITS) of the current cell.'''
+        if self._move_mask is None:
+            self._move_mask = build_move_mask(self._grid)
+        return self._move_mask[self.x, self.y]
+
     def _initialize_field(self) -> Tuple[int, int]:
         while(True):
-            x = random.randrange(self._map_width)
-            y = random.randrange(self._map_height)
+            x = self._rng.randrange(self._map_width)
+            y = self._rng.randrange(self._map_height)
             if self._grid[x][y] == 0:
                 return (x, y)
 
@@ -40,103 +60,111 @@ class Pacman(Character):
     '''Class for the Pacman.'''
     def __init__(self,
                  grid: np.ndarray,
-                 field_size: Tuple[int, int],
+                 field_size: Optional[Tuple[int, int]],
                  map_width: int,
                  map_height: int,
-                 image_path: str) -> None:
+                 image_path: Optional[str],
+                 rng=random,
+                 position: Optional[Tuple[int, int]] = None,
+                 move_mask: Optional[np.ndarray] = None) -> None:
         
         super().__init__(grid,
                         field_size,
                         map_width,
                         map_height,
-                        image_path)
+                        image_path,
+                        rng,
+                        position,
+                        move_mask)
         
     def _load_image(self):
-        player_image = pygame.image.load(self._image_path)
-        player_image = pygame.transform.scale(player_image, self._field_size)
-        return player_image
+        return load_scaled_image(self._image_path, self._field_size)
     
     def make_move(self, command: str) -> None:
-        if command == 'left':
-            if is_left_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
-                self.x -= 1
-        if command == 'right':
-            if is_right_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
-                self.x += 1
-        if command == 'up':
-            if is_up_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
-                self.y -= 1
-        if command == 'down':
-            if is_down_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
-                self.y += 1
+        if command in MOVE_BITS and self._possible_moves() & MOVE_BITS[command]:
+            dx, dy = MOVE_STEPS[command]
+            self.x += dx
+            self.y += dy
     
 
 class Dot(Character):
     '''Class for dots.'''
     def __init__(self,
                  grid: np.ndarray,
-                 field_size: Tuple[int, int],
+                 field_size: Optional[Tuple[int, int]],
                  map_width: int,
                  map_height: int,
-                 image_path: str) -> None:
+                 image_path: Optional[str],
+                 rng=random,
+                 position: Optional[Tuple[int, int]] = None) -> None:
         
         super().__init__(grid,
                         field_size,
                         map_width,
                         map_height,
-                        image_path)
+                        image_path,
+                        rng,
+                        position)
         
     def _load_image(self):
-        dot_image = pygame.image.load(self._image_path)
-        dot_image = pygame.transform.scale(dot_image, tuple(size//2 for size in self._field_size))
-        return dot_image
+        return load_scaled_image(self._image_path, tuple(size//2 for size in self._field_size))
     
 
 class Bonus(Character):
     '''Class for fireballs/hearts.'''
     def __init__(self,
                  grid: np.ndarray,
-                 field_size: Tuple[int, int],
+                 field_size: Optional[Tuple[int, int]],
                  map_width: int,
                  map_height: int,
-                 image_path: str) -> None:
+                 image_path: Optional[str],
+                 rng=random,
+                 position: Optional[Tuple[int, int]] = None) -> None:
         
         super().__init__(grid,
                         field_size,
                         map_width,
                         map_height,
-                        image_path)
+                        image_path,
+                        rng,
+                        position)
         
     def _load_image(self):
-        bonus_image = pygame.image.load(self._image_path)
-        bonus_image = pygame.transform.scale(bonus_image, tuple(size for size in self._field_size))
-        return bonus_image
+        return load_scaled_image(self._image_path, tuple(size for size in self._field_size))
     
 
 class Ghost(Character):
     '''Class for ghosts.'''
     def __init__(self,
                  grid: np.ndarray,
-                 field_size: Tuple[int, int],
+                 field_size: Optional[Tuple[int, int]],
                  map_width: int,
                  map_height: int,
-                 image_path: str) -> None:
+                 image_path: Optional[str],
+                 rng=random,
+                 sprite_id: int = 0,
+                 position: Optional[Tuple[int, int]] = None,
+                 move_mask: Optional[np.ndarray] = None) -> None:
         
         super().__init__(grid,
                         field_size,
                         map_width,
                         map_height,
-                        image_path)
+                        image_path,
+                        rng,
+                        position,
+                        move_mask)
+        # Index of the ghost picture, so headless ghosts can be drawn later
+        self.sprite_id = sprite_id
         
     def _load_image(self):
-        ghost_image = pygame.image.load(self._image_path)
-        ghost_image = pygame.transform.scale(ghost_image, self._field_size)
-        return ghost_image
+        return load_scaled_image(self._image_path, self._field_size)
     
     def make_move(self, pacman_x: int, pacman_y: int, mode: str) -> None:
         possible_ghost_ways = []
+        possible_moves = self._possible_moves()
 
-        if is_up_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
+        if possible_moves & UP:
             if mode == 'hunt':
                 [possible_ghost_ways.append('up') for i in range(1+2*int(pacman_y < self.y))]
             if mode == 'calm':
@@ -144,7 +172,7 @@ class Ghost(Character):
             if mode == 'fear':
                 [possible_ghost_ways.append('up') for i in range(1+2*int(pacman_y > self.y))]
 
-        if is_down_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
+        if possible_moves & DOWN:
             if mode == 'hunt':
                 [possible_ghost_ways.append('down') for i in range(1+2*int(pacman_y > self.y))]
             if mode == 'calm':
@@ -152,7 +180,7 @@ class Ghost(Character):
             if mode == 'fear':
                 [possible_ghost_ways.append('down') for i in range(1+2*int(pacman_y < self.y))]
 
-        if is_left_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
+        if possible_moves & LEFT:
             if mode == 'hunt':
                 [possible_ghost_ways.append('left') for i in range(1+2*int(pacman_x < self.x))]
             if mode == 'calm':
@@ -160,7 +188,7 @@ class Ghost(Character):
             if mode == 'fear':
                 [possible_ghost_ways.append('left') for i in range(1+2*int(pacman_x > self.x))]
 
-        if is_right_possible(self.x, self.y, self._map_width, self._map_height, self._grid):
+        if possible_moves & RIGHT:
             if mode == 'hunt':
                 [possible_ghost_ways.append('right') for i in range(1+2*int(pacman_x > self.x))]
             if mode == 'calm':
@@ -168,7 +196,7 @@ class Ghost(Character):
             if mode == 'fear':
                 [possible_ghost_ways.append('right') for i in range(1+2*int(pacman_x < self.x))]
 
-        direction = random.choice(possible_ghost_ways)
+        direction = self._rng.choice(possible_ghost_ways)
         if direction == 'up':
             self.y -= 1
         if direction == 'down':
@@ -176,4 +204,70 @@ class Ghost(Character):
         if direction == 'left':
             self.x -= 1
         if direction == 'right':
-            self.x += 1
\ No newline at end of file
+            self.x += 1
+
+
+class GhostGroup:
+    '''All ghosts of a level as a structure of arrays.
+
+    Positions and sprite ids live in numpy arrays, so a level with many
+    ghosts holds no per-ghost objects, grids or surfaces. Every ghost also
+    gets an id that stays with it while others are removed, ids grow in
+    the order the ghosts were added. The arrays use the smallest types that
+    fit, like the uint8 grid: int32 cells and ids, int8 sprite ids.'''
+    def __init__(self, capacity: int = 16) -> None:
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.sprite_id = np.zeros(capacity, dtype=np.int8)
+        self.id = np.zeros(capacity, dtype=np.int32)
+        self.count = 0
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, x: int, y: int, sprite_id: int) -> None:
+        if self.count == len(self.x):
+            self.x = np.resize(self.x, 2*self.count)
+            self.y = np.resize(self.y, 2*self.count)
+            self.sprite_id = np.resize(self.sprite_id, 2*self.count)
+            self.id = np.resize(self.id, 2*self.count)
+        self.x[self.count] = x
+        self.y[self.count] = y
+        self.sprite_id[self.count] = sprite_id
+        self.id[self.count] = self.next_id
+        self.count += 1
+        self.next_id += 1
+
+    def copy(self) -> 'GhostGroup':
+        ghosts = GhostGroup.__new__(GhostGroup)
+        ghosts.x = self.x.copy()
+        ghosts.y = self.y.copy()
+        ghosts.sprite_id = self.sprite_id.copy()
+        ghosts.id = self.id.copy()
+        ghosts.count = self.count
+        ghosts.next_id = self.next_id
+        return ghosts
+
+    def at(self, x: int, y: int) -> np.ndarray:
+        '''Indices of the ghosts standing on the cell.'''
+        return np.flatnonzero((self.x[:self.count] == x) & (self.y[:self.count] == y))
+
+    def remove(self, indices: np.ndarray) -> None:
+        '''Removes ghosts, keeping the others in order.'''
+        keep = np.ones(self.count, dtype=bool)
+        keep[indices] = False
+        kept = int(keep.sum())
+        self.x[:kept] = self.x[:self.count][keep]
+        self.y[:kept] = self.y[:self.count][keep]
+        self.sprite_id[:kept] = self.sprite_id[:self.count][keep]
+        self.id[:kept] = self.id[:self.count][keep]
+        self.count = kept
+
+    def make_move(self, pacman_x: int, pacman_y: int, mode: str, planner, rng: np.random.Generator) -> None:
+        '''Moves every ghost one step, see ghost_ai.GhostPlanner for the rules.'''
+        if self.count:
+            moves = planner.next_moves(self.x[:self.count].tolist(), self.y[:self.count].tolist(),
+                                       (pacman_x, pacman_y), mode, rng)
+            self.x[:self.count] += moves[:, 0]
+            self.y[:self.count] += moves[:, 1]
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import List, Optional
+from utils import MOVE_STEPS
+
+class RemoteGame:
+    '''A room's game rebuilt on the client from the server's updates.'''
+    def __init__(self) -> None:
+        self.grid = None
+        self.level = 0
+        self.score = 0
+        self.mode = 'hunt'
+        self.running = False
+        self.pacman = None
+        self.items = {}
+        self.ghosts = {}
+
+    def apply(self, message: dict) -> None:
+        if message["type"] == "full":
+            # Rows of the message, indexed grid[x][y] like the engine's grids
+            self.grid = [list(column) for column in zip(*message["grid"])]
+            self.level = message["level"]
+            self.score = message["score"]
+            self.mode = message["mode"]
+            self.running = message["running"]
+            self.pacman = tuple(message["pacman"])
+            self.items = {name: message[name] for name in ("dot", "fireball", "heart")}
+            self.ghosts = {ghost_id: (x, y, sprite) for ghost_id, x, y, sprite in message["ghosts"]}
+            return
+
+        self.score = message.get("score", self.score)
+        self.mode = message.get("mode", self.mode)
+        self.running = message.get("running", True)
+        moved = message.get("moved", {})
+        spawned = message.get("spawned", {})
+        removed = message.get("removed", {})
+        if "pacman" in moved:
+            self.pacman = tuple(moved["pacman"])
+        for ghost_id, x, y in moved.get("ghosts", ()):
+            self.ghosts[ghost_id] = (x, y, self.ghosts[ghost_id][2])
+        for ghost_id, x, y, sprite in spawned.get("ghosts", ()):
+            self.ghosts[ghost_id] = (x, y, sprite)
+        for ghost_id in removed.get("ghosts", ()):
+            del self.ghosts[ghost_id]
+        for name in ("dot", "fireball", "heart"):
+            if name in spawned:
+                self.items[name] = spawned[name]
+        for name in removed.get("items", ()):
+            self.items[name] = None
+        for x, y, wall in message.get("walls", ()):
+            self.grid[x][y] = str(wall)
+
+    def greedy_action(self, rng: random.Random) -> Optional[str]:
+        '''Steps towards the dot along the axes like policies.greedy_policy, randomly when walls are in the way.'''
+        if self.grid is None or self.items.get("dot") is None:
+            return None
+        x, y = self.pacman
+        dot_x, dot_y = self.items["dot"]
+        width, height = len(self.grid), len(self.grid[0])
+        moves = [action for action, (dx, dy) in MOVE_STEPS.items()
+                 if 0 <= x + dx < width and 0 <= y + dy < height and self.grid[x + dx][y + dy] == '0']
+        closer = [action for action in moves
+                  if abs(x + MOVE_STEPS[action][0] - dot_x) + abs(y + MOVE_STEPS[action][1] - dot_y)
+                  < abs(x - dot_x) + abs(y - dot_y)]
+        return rng.choice(closer or moves) if moves else None
+
+
+async def play(host: str, port: int, room: str, seconds: float, seed: Optional[int] = None,
+               rng: random.Random = random) -> dict:
+    '''Joins a room as a bot for a while and returns what it received.'''
+    reader, writer = await asyncio.open_connection(host, port)
+    join = {"join": room} if seed is None else {"join": room, "seed": seed}
+    writer.write(json.dumps(join).encode() + b"\n")
+    game = RemoteGame()
+    stats = {"full": 0, "tick": 0, "full_bytes": 0, "tick_bytes": 0, "games": 0, "best_score": 0, "best_level": 0}
+    deadline = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < deadline:
+            try:
+                line = await asyncio.wait_for(reader.readline(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                break
+            message = json.loads(line)
+            if message["type"] == "error":
+                raise RuntimeError(message["message"])
+            stats[message["type"]] += 1
+            stats[message["type"] + "_bytes"] += len(line)
+            if message["type"] == "full" and message["tick"] == 0:
+                stats["games"] += 1
+            game.apply(message)
+            stats["best_score"] = max(stats["best_score"], game.score)
+            stats["best_level"] = max(stats["best_level"], game.level)
+            if game.running:
+                writer.write(json.dumps({"action": game.greedy_action(rng)}).encode() + b"\n")
+    finally:
+        writer.close()
+    return stats
+
+
+async def play_many(host: str, port: int, clients: int, rooms: int, seconds: float, seed: int) -> List[dict]:
+    return await asyncio.gather(*(play(host, port, f"room-{client % rooms}", seconds, seed + client % rooms,
+                                       random.Random(seed + client))
+                                  for client in range(clients)))
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Connect bots to a pacman server and report the traffic they see.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--rooms", type=int, default=None, help="rooms the clients are spread over, one per client by default")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0, help="room i starts with seed + i")
+    args = parser.parse_args(args)
+
+    results = asyncio.run(play_many(args.host, args.port, args.clients, args.rooms or args.clients,
+                                    args.seconds, args.seed))
+    total = {key: sum(result[key] for result in results) for key in results[0]}
+    print(f"{args.clients} clients, {total['tick']} tick updates of {total['tick_bytes']/max(total['tick'], 1):.0f} bytes, "
+          f"{total['full']} full updates of {total['full_bytes']/max(total['full'], 1):.0f} bytes, "
+          f"{total['games']} games, best level {max(result['best_level'] for result in results)}, "
+          f"best score {max(result['best_score'] for result in results)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,116 @@
+from collections import deque
+from typing import List, Optional, Tuple
+import numpy as np
+
+# Ticks between two wall changes on the first and on the last level
+FIRST_LEVEL_INTERVAL = 40
+LAST_LEVEL_INTERVAL = 10
+# Random cells tried when looking for a wall to open or a cell to close
+MUTATION_TRIES = 8
+# Cells a connectivity check may visit before the closing is given up
+LOCAL_SEARCH_LIMIT = 64
+
+# The 8 cells around a cell in order, each one next to the one before
+_RING = ((-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0))
+# Ring positions of the 4 direct neighbours
+_SIDES = (1, 3, 5, 7)
+
+class WallChange:
+    '''One wall opened or closed, the newest entry of a persistent list of changes.
+
+    Entries never change once made, so a snapshot only keeps the newest
+    entry of its time and changes_between() finds the cells that differ
+    between any two of them.'''
+    __slots__ = ('cell', 'parent', 'depth')
+
+    def __init__(self, cell: Tuple[int, int], parent: Optional['WallChange']) -> None:
+        self.cell = cell
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 1
+
+
+class WallLog:
+    '''The wall changes applied to one level's maze, shared by its snapshots.'''
+    __slots__ = ('head',)
+
+    def __init__(self, head: Optional[WallChange] = None) -> None:
+        self.head = head
+
+    def add(self, cell: Tuple[int, int]) -> None:
+        self.head = WallChange(cell, self.head)
+
+
+def _depth(change: Optional[WallChange]) -> int:
+    return change.depth if change is not None else 0
+
+def changes_between(old: Optional[WallChange], new: Optional[WallChange]) -> Tuple[List[tuple], List[tuple]]:
+    '''Cells toggled to go back from old to the common ancestor, then the ones leading to new, in order.'''
+    undo, redo = [], []
+    while _depth(old) > _depth(new):
+        undo.append(old.cell)
+        old = old.parent
+    while _depth(new) > _depth(old):
+        redo.append(new.cell)
+        new = new.parent
+    while old is not new:
+        undo.append(old.cell)
+        old = old.parent
+        redo.append(new.cell)
+        new = new.parent
+    return undo, redo[::-1]
+
+def mutation_interval(level: int, max_level: int) -> int:
+    '''Ticks between wall changes, harder levels change more often.'''
+    progress = (level - 1) / max(max_level - 1, 1)
+    return round(FIRST_LEVEL_INTERVAL + (LAST_LEVEL_INTERVAL - FIRST_LEVEL_INTERVAL)*progress)
+
+
+def _is_open(grid: np.ndarray, x: int, y: int) -> bool:
+    return 0 <= x < grid.shape[0] and 0 <= y < grid.shape[1] and grid.item(x, y) == 0
+
+def can_open(grid: np.ndarray, x: int, y: int) -> bool:
+    '''A wall may open when it joins the open region, it would be cut off otherwise.'''
+    return grid.item(x, y) == 1 and any(_is_open(grid, x + dx, y + dy) for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)))
+
+def can_close(grid: np.ndarray, x: int, y: int) -> bool:
+    '''Whether the open cell can become a wall with the other open cells staying connected.
+
+    Usually the ring of 8 cells around it answers: if all open direct
+    neighbours lie on one open stretch of the ring, they stay connected
+    around the closed cell. Otherwise a flood fill from one neighbour,
+    limited to LOCAL_SEARCH_LIMIT cells, has to reach the others. When it
+    runs out the closing is refused, so the maze is never split.'''
+    ring = [_is_open(grid, x + dx, y + dy) for dx, dy in _RING]
+    sides = [(x + _RING[side][0], y + _RING[side][1]) for side in _SIDES if ring[side]]
+    if not sides:
+        # The last open cell
+        return False
+    if len(sides) == 1 or all(ring):
+        return True
+    # Open stretches of the ring that hold a direct neighbour, consecutive ring cells touch
+    stretches = 0
+    for position in range(8):
+        if ring[position] and not ring[position - 1]:
+            end = position
+            touches = False
+            while ring[end % 8]:
+                touches = touches or end % 8 in _SIDES
+                end += 1
+            stretches += touches
+    if stretches == 1:
+        return True
+
+    targets = set(sides[1:])
+    seen = {(x, y), sides[0]}
+    queue = deque([sides[0]])
+    while queue and len(seen) <= LOCAL_SEARCH_LIMIT:
+        cell_x, cell_y = queue.popleft()
+        for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+            neighbor = (cell_x + dx, cell_y + dy)
+            if neighbor not in seen and _is_open(grid, *neighbor):
+                targets.discard(neighbor)
+                if not targets:
+                    return True
+                seen.add(neighbor)
+                queue.append(neighbor)
+    return False
@@ -0,0 +1,423 @@
+import copy
+import random
+from collections import deque
+from typing import List, Optional, Tuple
+import numpy as np
+from maze_provider import MazeProvider
+from characters import Pacman, Dot, Bonus, GhostGroup
+from utils import build_move_mask, update_move_mask
+from spawn_index import SpawnIndex
+from ghost_ai import GhostPlanner
+from profiler import Profiler
+from dynamic_maze import MUTATION_TRIES, WallLog, can_close, can_open, changes_between, mutation_interval
+
+# Commands understood by Pacman.make_move; None means "stand still"
+ACTIONS = ('left', 'right', 'up', 'down')
+MAX_LEVEL = 10
+# New ghosts appear more than this many cells away from pacman along both axes
+GHOST_SPAWN_DISTANCE = 5
+
+class GameState:
+    '''Everything that changes during a game, without any rendering data.'''
+    def __init__(self,
+                 grid: np.ndarray,
+                 pacman: Pacman,
+                 dot: Dot,
+                 fireball: Bonus,
+                 heart: Bonus,
+                 ghosts: GhostGroup,
+                 level: int,
+                 fireball_counter: int,
+                 heart_counter: int,
+                 spawn_index: SpawnIndex,
+                 ghost_planner: GhostPlanner,
+                 move_mask: np.ndarray,
+                 walls: WallLog) -> None:
+
+        self.grid = grid
+        self.move_mask = move_mask
+        # Walls opened and closed during the level, see dynamic_maze
+        self.walls = walls
+        self.spawn_index = spawn_index
+        self.ghost_planner = ghost_planner
+        self.pacman = pacman
+        self.dot = dot
+        self.fireball = fireball
+        self.heart = heart
+        self.ghosts = ghosts
+        self.level = level
+        self.fireball_counter = fireball_counter
+        self.heart_counter = heart_counter
+        self.score = 0
+        self.ghost_mode = 'hunt'
+        self.running = True
+        self.tick = 0
+
+
+class Snapshot:
+    '''A frozen game state and the engine's random streams, made by Engine.snapshot().
+
+    The maze, move mask and ghost planner of a level are shared, not copied.
+    Positions are small tuples and arrays, so taking and restoring a
+    snapshot costs microseconds. With dynamic walls the snapshot keeps the
+    newest wall change, restoring toggles the cells changed since.'''
+    __slots__ = ('grid', 'move_mask', 'ghost_planner', 'walls', 'wall_head', 'level', 'positions', 'ghosts',
+                 'spawn_index', 'counters', 'rng_state', 'np_rng_state')
+
+    def __init__(self, state: GameState, rng_state: tuple, np_rng_state: dict) -> None:
+        self.grid = state.grid
+        self.move_mask = state.move_mask
+        self.ghost_planner = state.ghost_planner
+        self.walls = state.walls
+        self.wall_head = state.walls.head
+        self.level = state.level
+        self.positions = ((state.pacman.x, state.pacman.y), (state.dot.x, state.dot.y),
+                          (state.fireball.x, state.fireball.y), (state.heart.x, state.heart.y))
+        self.ghosts = state.ghosts.copy()
+        self.spawn_index = state.spawn_index.copy()
+        self.counters = (state.score, state.fireball_counter, state.heart_counter, state.ghost_mode,
+                         state.running, state.tick)
+        self.rng_state = rng_state
+        self.np_rng_state = np_rng_state
+
+
+class Engine:
+    '''Pure python game rules. Advances the game one tick per step() call.
+
+    With undo_depth > 0 the engine keeps snapshots of that many past ticks
+    for undo(). With dynamic_walls walls open and close during a level, more
+    often on harder levels, and the open cells always stay connected.'''
+    def __init__(self,
+                 map_width: int,
+                 map_height: int,
+                 wall_density: float,
+                 fireball_time: int,
+                 heart_time: int,
+                 max_score: int,
+                 ghost_sprites: int = 1,
+                 maze_provider: Optional[MazeProvider] = None,
+                 profiler: Optional[Profiler] = None,
+                 undo_depth: int = 0,
+                 dynamic_walls: bool = False) -> None:
+
+        self.map_width = map_width
+        self.map_height = map_height
+        self.wall_density = wall_density
+        self.fireball_time = fireball_time
+        self.heart_time = heart_time
+        self.max_score = max_score
+        self.ghost_sprites = ghost_sprites
+        self.dynamic_walls = dynamic_walls
+        # Mazes always come from a provider, so a seed gives the same game with or without the background pool
+        self.maze_provider = maze_provider if maze_provider is not None else MazeProvider(workers=0)
+        self.profiler = profiler if profiler is not None else Profiler()
+
+        self.seed = None
+        self.rng = random.Random()
+        self.np_rng = np.random.default_rng()
+        self.state = None
+        self._history = deque(maxlen=undo_depth)
+        # State of self.rng as of its last use, getstate() is too slow to call for every snapshot
+        self._rng_state = None
+
+    def reset(self, seed: Optional[int] = None) -> GameState:
+        '''Starts a new game from the first level.'''
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.rng = random.Random(self.seed)
+        self.np_rng = np.random.default_rng(self.rng.getrandbits(64))
+        self.state = self._new_level(1)
+        self._history.clear()
+        self._rng_state = None
+        return self.state
+
+    def snapshot(self) -> Snapshot:
+        '''Freezes the current state, see restore().'''
+        if self._rng_state is None:
+            self._rng_state = self.rng.getstate()
+        return Snapshot(self.state, self._rng_state, self.np_rng.bit_generator.state)
+
+    def restore(self, snapshot: Snapshot) -> GameState:
+        '''Continues from a snapshot. The same snapshot can be restored any number of times.
+
+        The ticks played before cannot be undone afterwards. With dynamic
+        walls a snapshot shares the maze of the engine that took it, so it
+        is restored into that engine only.'''
+        self._history.clear()
+        return self._load(snapshot)
+
+    def _load(self, snapshot: Snapshot) -> GameState:
+        grid = snapshot.grid
+        walls = snapshot.walls
+        if walls.head is not snapshot.wall_head:
+            undo, redo = changes_between(walls.head, snapshot.wall_head)
+            for x, y in undo + redo:
+                self._toggle_wall(grid, snapshot.move_mask, snapshot.ghost_planner, x, y)
+            walls.head = snapshot.wall_head
+        (pacman_x, pacman_y), dot, fireball, heart = snapshot.positions
+        pacman = Pacman(grid, None, self.map_width, self.map_height, None, self.rng,
+                        position=(pacman_x, pacman_y), move_mask=snapshot.move_mask)
+        score, fireball_counter, heart_counter, ghost_mode, running, tick = snapshot.counters
+
+        state = GameState(grid, pacman,
+                          Dot(grid, None, self.map_width, self.map_height, None, self.rng, position=dot),
+                          Bonus(grid, None, self.map_width, self.map_height, None, self.rng, position=fireball),
+                          Bonus(grid, None, self.map_width, self.map_height, None, self.rng, position=heart),
+                          snapshot.ghosts.copy(), snapshot.level, fireball_counter, heart_counter,
+                          snapshot.spawn_index.copy(), snapshot.ghost_planner, snapshot.move_mask, walls)
+        state.score = score
+        state.ghost_mode = ghost_mode
+        state.running = running
+        state.tick = tick
+
+        if snapshot.rng_state is not self._rng_state:
+            self.rng.setstate(snapshot.rng_state)
+            self._rng_state = snapshot.rng_state
+        self.np_rng.bit_generator.state = snapshot.np_rng_state
+        self.state = state
+        return state
+
+    def clone(self) -> 'Engine':
+        '''An independent engine at the current state, sharing settings, maze provider and profiler.
+
+        Restoring snapshots into one engine is cheaper when many copies are needed.'''
+        engine = copy.copy(self)
+        engine.rng = random.Random.__new__(random.Random)
+        engine.np_rng = np.random.Generator(type(self.np_rng.bit_generator)())
+        engine._history = deque(maxlen=self._history.maxlen)
+        engine._rng_state = None
+        snapshot = self.snapshot()
+        if self.dynamic_walls:
+            # The copy changes its walls on its own
+            snapshot.grid = snapshot.grid.copy()
+            snapshot.move_mask = snapshot.move_mask.copy()
+            snapshot.ghost_planner = snapshot.ghost_planner.copy()
+            snapshot.walls = WallLog(snapshot.wall_head)
+        engine._load(snapshot)
+        return engine
+
+    def undo(self, ticks: int = 1) -> GameState:
+        '''Goes back the given number of ticks, at most undo_depth.'''
+        if ticks > len(self._history):
+            raise ValueError(f"Only {len(self._history)} ticks can be undone")
+        for _ in range(ticks - 1):
+            self._history.pop()
+        return self._load(self._history.pop())
+
+    def move_wall(self) -> GameState:
+        '''Opens one wall and closes one free cell now, the maze change step() makes every few ticks with dynamic_walls.
+
+        The change belongs to no tick, tools and benchmarks use it to change the maze on demand.'''
+        self._move_wall(self.state)
+        return self.state
+
+    def _maze_rng(self, level: int) -> random.Random:
+        '''Every level's maze has its own rng, so the next maze can be prepared in advance.'''
+        return random.Random(f"{self.seed}-{level}")
+
+    def _generate_maze(self, level: int) -> np.ndarray:
+        grid = self.maze_provider(self.map_width, self.map_height, self.wall_density, 0.1, level/10,
+                                  self._maze_rng(level))
+        if level < MAX_LEVEL:
+            self.maze_provider.prefetch(self.map_width, self.map_height, self.wall_density, 0.1, (level+1)/10,
+                                        self._maze_rng(level+1))
+        return grid
+
+    def _new_level(self, level: int) -> GameState:
+        grid = self._generate_maze(level)
+        if self.dynamic_walls:
+            # Cached mazes are read-only memory maps
+            grid = np.array(grid)
+        move_mask = build_move_mask(grid)
+        spawn_index = SpawnIndex(grid)
+
+        pacman = Pacman(grid, None, self.map_width, self.map_height, None, self.rng,
+                        position=spawn_index.sample(self.rng), move_mask=move_mask)
+        spawn_index.occupy(pacman.x, pacman.y)
+        dot = self._spawn(Dot, grid, spawn_index, spawn_index.sample(self.rng))
+        # Bonuses are kept off the map until they are spawned
+        fireball = self._spawn(Bonus, grid, spawn_index, (-1, -1))
+        heart = self._spawn(Bonus, grid, spawn_index, (-1, -1))
+        ghosts = GhostGroup()
+        self._spawn_ghost(ghosts, spawn_index, spawn_index.sample(self.rng))
+
+        return GameState(grid, pacman, dot, fireball, heart, ghosts, level,
+                         self.fireball_time, self.heart_time, spawn_index, GhostPlanner(grid), move_mask, WallLog())
+
+    def _spawn(self, character_class, grid: np.ndarray, spawn_index: SpawnIndex, position: Tuple[int, int]):
+        character = character_class(grid, None, self.map_width, self.map_height, None, self.rng,
+                                    position=position)
+        spawn_index.occupy(character.x, character.y)
+        return character
+
+    def _spawn_ghost(self, ghosts: GhostGroup, spawn_index: SpawnIndex, position: Tuple[int, int]) -> None:
+        ghosts.add(position[0], position[1], self.rng.randrange(self.ghost_sprites))
+        spawn_index.occupy(*position)
+
+    def step(self, action: Optional[str]) -> Tuple[GameState, List[str]]:
+        '''Plays one tick with the given pacman command.
+
+        Returns the new state and the list of events that happened during the tick:
+        'dot', 'level', 'win', 'fireball', 'heart', 'ghost_eaten' and 'death'.'''
+        state = self.state
+        events = []
+        if not state.running:
+            return state, events
+        if self._history.maxlen:
+            self._history.append(self.snapshot())
+        state.tick += 1
+
+        # Ghost behaviour mode
+        state.ghost_mode = 'hunt'
+
+        # To immediate change
+        if state.fireball_counter == 0: state.heart_counter += self.heart_time
+        if state.heart_counter == 0: state.fireball_counter += self.fireball_time
+
+        state.fireball_counter += 1
+        if state.fireball_counter < self.fireball_time:
+            state.ghost_mode = 'calm'
+
+        state.heart_counter += 1
+        if state.heart_counter < self.heart_time:
+            state.ghost_mode = 'fear'
+
+        # Pacman behaviour
+        pacman = state.pacman
+        spawn_index = state.spawn_index
+        profiler = self.profiler
+        if action is not None:
+            with profiler.span('pacman'):
+                old_x, old_y = pacman.x, pacman.y
+                pacman.make_move(command=action)
+                spawn_index.move(old_x, old_y, pacman.x, pacman.y)
+
+        # The occupancy counts tell in one lookup whether pacman shares his cell with anything
+        contact = spawn_index.occupants(pacman.x, pacman.y) > 1
+
+        # Update game state
+        if contact and pacman.x == state.dot.x and pacman.y == state.dot.y:
+            # Spawning and level changes draw from self.rng
+            self._rng_state = None
+            state.score += 1
+            events.append('dot')
+
+            if state.score == self.max_score:
+                if state.level == MAX_LEVEL:
+                    state.running = False
+                    events.append('win')
+                    return state, events
+                with profiler.span('level'):
+                    new_state = self._new_level(state.level + 1)
+                new_state.tick = state.tick
+                self.state = new_state
+                events.append('level')
+                return new_state, events
+
+            with profiler.span('spawn'):
+                # When every open cell is taken the dot shares a cell, it must always exist
+                spawn_index.release(state.dot.x, state.dot.y)
+                cell = spawn_index.sample(self.rng) or spawn_index.sample_open(self.rng)
+                state.dot = self._spawn(Dot, state.grid, spawn_index, cell)
+
+                if self.rng.randrange(10) == 0:
+                    cell = spawn_index.sample(self.rng)
+                    if cell is not None:
+                        spawn_index.release(state.fireball.x, state.fireball.y)
+                        state.fireball = self._spawn(Bonus, state.grid, spawn_index, cell)
+                if self.rng.randrange(5) == 0:
+                    cell = spawn_index.sample(self.rng)
+                    if cell is not None:
+                        spawn_index.release(state.heart.x, state.heart.y)
+                        state.heart = self._spawn(Bonus, state.grid, spawn_index, cell)
+
+                # No ghost appears if every free cell is too close to pacman
+                cell = spawn_index.sample(self.rng, away_from=(pacman.x, pacman.y), distance=GHOST_SPAWN_DISTANCE)
+                if cell is not None:
+                    self._spawn_ghost(state.ghosts, spawn_index, cell)
+
+        # Fireball catching
+        if contact and pacman.x == state.fireball.x and pacman.y == state.fireball.y:
+            state.fireball_counter = 0
+            spawn_index.release(state.fireball.x, state.fireball.y)
+            state.fireball.x, state.fireball.y = -1, -1
+            events.append('fireball')
+
+        # Heart catching
+        if contact and pacman.x == state.heart.x and pacman.y == state.heart.y:
+            state.heart_counter = 0
+            spawn_index.release(state.heart.x, state.heart.y)
+            state.heart.x, state.heart.y = -1, -1
+            events.append('heart')
+
+        # Ghost behaviour
+        ghosts = state.ghosts
+        if contact and self._ghost_contact(state, events):
+            return state, events
+
+        # All ghosts read their moves from one distance field
+        with profiler.span('ghosts'):
+            old_cells = list(zip(ghosts.x[:ghosts.count].tolist(), ghosts.y[:ghosts.count].tolist()))
+            ghosts.make_move(pacman.x, pacman.y, state.ghost_mode, state.ghost_planner, self.np_rng)
+            new_cells = zip(ghosts.x[:ghosts.count].tolist(), ghosts.y[:ghosts.count].tolist())
+            for (old_x, old_y), (x, y) in zip(old_cells, new_cells):
+                spawn_index.move(old_x, old_y, x, y)
+
+        # A ghost stepping onto pacman catches him as well. Pacman stepping onto a ghost
+        # that moves the other way was already caught above, before the ghost moved
+        if self._ghost_contact(state, events):
+            return state, events
+
+        if self.dynamic_walls and state.tick % mutation_interval(state.level, MAX_LEVEL) == 0:
+            with profiler.span('walls'):
+                self._move_wall(state)
+        return state, events
+
+    def _toggle_wall(self, grid: np.ndarray, move_mask: np.ndarray, planner: GhostPlanner, x: int, y: int) -> None:
+        '''Opens or closes a cell, updating the maze data around it.'''
+        grid[x, y] ^= 1
+        update_move_mask(grid, move_mask, x, y)
+        planner.update_cell(grid, x, y)
+
+    def _move_wall(self, state: GameState) -> None:
+        '''Opens one wall next to the open cells and closes one free cell whose neighbours stay connected.'''
+        self._rng_state = None
+        grid = state.grid
+        spawn_index = state.spawn_index
+        for _ in range(MUTATION_TRIES):
+            x, y = self.rng.randrange(self.map_width), self.rng.randrange(self.map_height)
+            if can_open(grid, x, y):
+                self._toggle_wall(grid, state.move_mask, state.ghost_planner, x, y)
+                state.walls.add((x, y))
+                spawn_index.open_cell(x, y)
+                break
+        for _ in range(MUTATION_TRIES):
+            cell = spawn_index.sample(self.rng)
+            if cell is None:
+                break
+            if can_close(grid, *cell):
+                self._toggle_wall(grid, state.move_mask, state.ghost_planner, *cell)
+                state.walls.add(cell)
+                spawn_index.close_cell(*cell)
+                break
+
+    def _ghost_contact(self, state: GameState, events: List[str]) -> bool:
+        '''Resolves ghosts on pacman's cell: death, or eaten ghosts in calm mode. Returns True on death.'''
+        pacman = state.pacman
+        spawn_index = state.spawn_index
+        ghosts_here = spawn_index.occupants(pacman.x, pacman.y) - 1
+        for item in (state.dot, state.fireball, state.heart):
+            if item.x == pacman.x and item.y == pacman.y:
+                ghosts_here -= 1
+        if ghosts_here <= 0:
+            return False
+
+        if state.ghost_mode != 'calm':
+            state.running = False
+            events.append('death')
+            return True
+        touching = state.ghosts.at(pacman.x, pacman.y)
+        events.extend(['ghost_eaten']*len(touching))
+        for _ in touching:
+            spawn_index.release(pacman.x, pacman.y)
+        state.ghosts.remove(touching)
+        return False
@@ -0,0 +1,293 @@
+from collections import OrderedDict
+from typing import List, Tuple
+import numpy as np
+
+# Ghost directions in the order used by Ghost.make_move: up, down, left, right
+GHOST_STEPS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+GHOST_MOVES = np.array(GHOST_STEPS, dtype=np.int8)
+# Below this many ghosts a plain python loop is faster than numpy
+VECTORIZE_FROM = 32
+# Below this many cells, converting between cell ids and bits is faster one cell at a time
+UNPACK_FROM = 64
+# Memory for the cached searches, a search takes about 8 bytes per cell of the maze
+CACHE_BYTES = 64 << 20
+
+def _to_bits(mask: np.ndarray) -> int:
+    '''A boolean array of flat cells as one python int, bit i set for cell i.'''
+    return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+def _cell_bits(cells, size: int) -> int:
+    '''The bits of a list or array of flat cell ids.'''
+    if len(cells) < UNPACK_FROM:
+        bits = 0
+        for cell in cells:
+            bits |= 1 << int(cell)
+        return bits
+    mask = np.zeros(size, dtype=bool)
+    mask[cells] = True
+    return _to_bits(mask)
+
+def _bit_cells(bits: int, size: int):
+    '''Flat ids of the set bits.'''
+    if bits.bit_count() < UNPACK_FROM:
+        cells = []
+        while bits:
+            low = bits & -bits
+            cells.append(low.bit_length() - 1)
+            bits ^= low
+        return cells
+    data = np.frombuffer(bits.to_bytes((size + 7)//8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(data, bitorder='little'))
+
+
+class _Search:
+    '''A breadth-first search from one cell that can be continued later.
+
+    Layers are sets of cells kept as bits of python ints, so a whole layer
+    is settled with a few shifts and masks. Only the distances of cells
+    asked for are written to field. Bit b of every settled cell's distance
+    is kept in planes[b], so cells asked for later are looked up there
+    instead of searching again.'''
+    __slots__ = ('unreached', 'frontier', 'recorded', 'planes', 'step', 'field')
+
+    def __init__(self, source: int, open_bits: int, size: int) -> None:
+        self.frontier = self.recorded = 1 << source
+        self.unreached = open_bits & ~self.frontier
+        self.planes = []
+        self.step = 0
+        self.field = np.full(size, size, dtype=np.int32)
+        self.field[source] = 0
+
+
+class GhostPlanner:
+    '''Moves all ghosts of a level using one BFS distance field from pacman.
+
+    Like Ghost.make_move, a ghost picks a random possible direction and a
+    preferred direction is three times as likely. Here a direction is
+    preferred when it brings the ghost closer to pacman along the maze
+    ('hunt') or further away ('fear'), so walls are taken into account.
+    In 'calm' mode every possible direction is equally likely.'''
+    def __init__(self, grid: np.ndarray, cache_bytes: int = CACHE_BYTES) -> None:
+        self._width, self._height = grid.shape
+        ids = np.arange(grid.size).reshape(grid.shape)
+
+        # Flat id of the neighbour in every direction, -1 for walls and the map border
+        neighbors = np.full(grid.shape + (4,), -1, dtype=np.int64)
+        neighbors[:, 1:, 0] = ids[:, :-1]
+        neighbors[:, :-1, 1] = ids[:, 1:]
+        neighbors[1:, :, 2] = ids[:-1, :]
+        neighbors[:-1, :, 3] = ids[1:, :]
+        is_open = np.asarray(grid).ravel() == 0
+        neighbors = neighbors.reshape(grid.size, 4)
+        neighbors[(neighbors >= 0) & ~is_open[np.maximum(neighbors, 0)]] = -1
+        self._neighbors = neighbors
+        self._neighbor_lists = neighbors.tolist()
+
+        # The maze as bits for the searches. A column's cells have consecutive ids, so a step
+        # up or down is a shift by one that must not wrap into the next column
+        row = ids.ravel() % self._height
+        self._open = _to_bits(is_open)
+        self._not_last_row = _to_bits(row != self._height - 1)
+        self._not_first_row = _to_bits(row != 0)
+
+        # Searches by pacman cell, pacman keeps returning to the same cells
+        self._cache = OrderedDict()
+        self._cache_size = max(1, cache_bytes // (8*grid.size))
+
+    def copy(self) -> 'GhostPlanner':
+        '''A planner for a copy of the maze, without the cached searches.'''
+        planner = GhostPlanner.__new__(GhostPlanner)
+        planner._width, planner._height = self._width, self._height
+        planner._neighbors = self._neighbors.copy()
+        planner._neighbor_lists = [row[:] for row in self._neighbor_lists]
+        planner._open = self._open
+        planner._not_last_row = self._not_last_row
+        planner._not_first_row = self._not_first_row
+        planner._cache = OrderedDict()
+        planner._cache_size = self._cache_size
+        return planner
+
+    def update_cell(self, grid: np.ndarray, x: int, y: int) -> None:
+        '''Follows a cell that opened or closed: only the neighbours' links to it change.
+
+        A cached search stays valid while the change is beyond what it has
+        settled: a closed cell it did not reach yet, or an opened cell whose
+        settled neighbours are all in its last layer. Other searches are
+        dropped and done again as far as the ghosts need them.'''
+        cell = x*self._height + y
+        bit = 1 << cell
+        is_open = grid.item(x, y) == 0
+        link = cell if is_open else -1
+        # Direction from each neighbour back to the cell: down, up, right, left
+        for (dx, dy), back in zip(GHOST_STEPS, (1, 0, 3, 2)):
+            if 0 <= x + dx < self._width and 0 <= y + dy < self._height:
+                neighbor = cell + dx*self._height + dy
+                self._neighbors[neighbor, back] = link
+                self._neighbor_lists[neighbor][back] = link
+        self._open = self._open | bit if is_open else self._open & ~bit
+
+        around = 0
+        for neighbor in self._neighbor_lists[cell]:
+            if neighbor >= 0:
+                around |= 1 << neighbor
+        for source, search in list(self._cache.items()):
+            if is_open:
+                # Anding with the small int of the neighbours keeps these cheap
+                settled_before = around ^ (around & search.unreached) ^ (around & search.frontier)
+                if settled_before:
+                    del self._cache[source]
+                else:
+                    search.unreached |= bit
+            elif search.unreached & bit:
+                search.unreached ^= bit
+            else:
+                del self._cache[source]
+
+    def distance_field(self, target: Tuple[int, int], cells=None) -> np.ndarray:
+        '''Number of steps from target to the given flat cell ids, grid.size where it is not known.
+
+        Without cells the whole field is computed. Otherwise the search stops
+        once all given cells are settled and only their distances (and those
+        of earlier calls) are filled in. Searches are cached per target and
+        continued when a later call needs more of the field.'''
+        return self._search(target, cells).field
+
+    def _search(self, target: Tuple[int, int], cells=None) -> _Search:
+        size = self._width*self._height
+        source = target[0]*self._height + target[1]
+        search = self._cache.get(source)
+        if search is None:
+            search = self._cache[source] = _Search(source, self._open, size)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(source)
+
+        wanted = self._open if cells is None else _cell_bits(cells, size)
+        missing = wanted & ~search.recorded
+        settled = missing & ~search.unreached
+        if settled:
+            # Settled by an earlier call that did not ask for them
+            self._recover(search, settled)
+            missing ^= settled
+        while missing and search.frontier:
+            found = self._expand(search) & missing
+            if found:
+                search.field[_bit_cells(found, size)] = search.step
+                search.recorded |= found
+                missing ^= found
+        return search
+
+    def _recover(self, search: '_Search', bits: int) -> None:
+        '''Writes the distances of settled cells to field, reading them from the planes.'''
+        size = self._width*self._height
+        planes = search.planes
+        if bits.bit_count() < UNPACK_FROM:
+            for cell in _bit_cells(bits, size):
+                distance = 0
+                for index, plane in enumerate(planes):
+                    if plane >> cell & 1:
+                        distance |= 1 << index
+                search.field[cell] = distance
+        else:
+            # Only the bytes of the cells are read from every plane
+            cells = _bit_cells(bits, size)
+            nbytes = (size + 7)//8
+            data = np.frombuffer(b"".join(plane.to_bytes(nbytes, 'little') for plane in planes),
+                                 dtype=np.uint8).reshape(len(planes), nbytes)
+            digits = (data[:, cells >> 3] >> (cells & 7).astype(np.uint8)) & 1
+            search.field[cells] = (1 << np.arange(len(planes), dtype=np.int32)) @ digits.astype(np.int32)
+        search.recorded |= bits
+
+    def _expand(self, search: '_Search') -> int:
+        '''Settles the next BFS layer and returns its cells.'''
+        frontier = search.frontier
+        height = self._height
+        layer = (((frontier >> 1) & self._not_last_row) | ((frontier << 1) & self._not_first_row)
+                 | (frontier >> height) | (frontier << height)) & search.unreached
+        search.unreached ^= layer
+        search.frontier = layer
+        search.step += 1
+
+        step = search.step
+        planes = search.planes
+        if step == 1 << len(planes):
+            planes.append(0)
+        index = 0
+        while step:
+            if step & 1:
+                planes[index] |= layer
+            step >>= 1
+            index += 1
+        return layer
+
+    def next_moves(self,
+                   xs: List[int],
+                   ys: List[int],
+                   target: Tuple[int, int],
+                   mode: str,
+                   rng: np.random.Generator) -> np.ndarray:
+        '''Returns the (dx, dy) step of every ghost, (0, 0) for ghosts that cannot move.'''
+        # Both paths draw the same random numbers and give the same moves
+        picks = rng.random(len(xs))
+        if len(xs) < VECTORIZE_FROM:
+            return self._next_moves_few(xs, ys, target, mode, picks)
+
+        cells = np.asarray(xs)*self._height + np.asarray(ys)
+        neighbors = self._neighbors[cells]
+        possible = neighbors >= 0
+
+        if mode == 'calm':
+            preferred = np.zeros_like(possible)
+        else:
+            # A ghost compares its cell with the cells around it
+            field = self.distance_field(target, np.concatenate([cells, neighbors[possible]]))
+            here = field[cells][:, None]
+            there = field[np.maximum(neighbors, 0)]
+            preferred = (there < here) if mode == 'hunt' else (there > here)
+
+        weights = (1 + 2*preferred) * possible
+        cumulative = np.cumsum(weights, axis=1)
+        total = cumulative[:, -1]
+        direction = np.argmax(cumulative > (picks*total)[:, None], axis=1)
+
+        moves = GHOST_MOVES[direction]
+        moves[total == 0] = 0
+        return moves
+
+    def _next_moves_few(self,
+                        xs: List[int],
+                        ys: List[int],
+                        target: Tuple[int, int],
+                        mode: str,
+                        picks: np.ndarray) -> np.ndarray:
+        '''Same as the vectorized path, numpy calls cost more than they save for a few ghosts.'''
+        cells = [x*self._height + y for x, y in zip(xs, ys)]
+        distance = None
+        if mode != 'calm':
+            around = [neighbor for cell in cells for neighbor in self._neighbor_lists[cell] if neighbor >= 0]
+            distance = self._search(target, cells + around).field
+
+        moves = []
+        for cell, pick in zip(cells, picks.tolist()):
+            weights = []
+            for neighbor in self._neighbor_lists[cell]:
+                if neighbor < 0:
+                    weights.append(0)
+                elif mode == 'hunt':
+                    weights.append(3 if distance.item(neighbor) < distance.item(cell) else 1)
+                elif mode == 'fear':
+                    weights.append(3 if distance.item(neighbor) > distance.item(cell) else 1)
+                else:
+                    weights.append(1)
+
+            move = (0, 0)
+            pick *= sum(weights)
+            cumulative = 0
+            for direction, weight in enumerate(weights):
+                cumulative += weight
+                if cumulative > pick:
+                    move = GHOST_STEPS[direction]
+                    break
+            moves.append(move)
+        return np.array(moves, dtype=np.int8).reshape(len(moves), 2)
@@ -1,20 +1,22 @@
 import random
+from collections import deque
 import numpy as np
 
 # Directions for moving in the grid: right, down, left, up
 DIRECTIONS = [(0, 1), (1, 0), (0, -1), (-1, 0)]
 
 class Maze:
-    def __init__(self, rows: int, cols: int, wall_density: float, fragmentation: float):
+    def __init__(self, rows: int, cols: int, wall_density: float, fragmentation: float, rng=random):
         self.rows = rows
         self.cols = cols
         self.wall_density = wall_density
         self.fragmentation = fragmentation
+        self.rng = rng
         # Start with a grid full of walls
         self.grid = [[1 for _ in range(cols)] for _ in range(rows)]
 
         # Mark the randomized start point
-        self.start = (random.randrange(rows), random.randrange(cols))
+        self.start = (self.rng.randrange(rows), self.rng.randrange(cols))
         self.grid[self.start[0]][self.start[1]] = 0
     
     def is_within_bounds(self, r, c):
@@ -23,50 +25,116 @@ class Maze:
     
     def get_neighbors(self, r, c):
         """Get valid neighbors (within bounds) of a cell (r, c). """
+        # Same order as DIRECTIONS, unrolled because this is the hottest call of the generator
         neighbors = []
-        for dr, dc in DIRECTIONS:
-            nr, nc = r + dr, c + dc
-            if self.is_within_bounds(nr, nc):
-                neighbors.append((nr, nc))
+        if c + 1 < self.cols:
+            neighbors.append((r, c + 1))
+        if r + 1 < self.rows:
+            neighbors.append((r + 1, c))
+        if c > 0:
+            neighbors.append((r, c - 1))
+        if r > 0:
+            neighbors.append((r - 1, c))
         return neighbors
     
-    def dfs(self, r, c, visited):
-        """Depth-First Search to mark visited cells and ensure connectivity. """
-        visited.add((r, c))
-        # Shuffle directions to make maze more random
-        neighbors = self.get_neighbors(r, c)
-        random.shuffle(neighbors)
-        
-        for nr, nc in neighbors:
-            if (nr, nc) not in visited and self.grid[nr][nc] == 0:
-                self.dfs(nr, nc, visited)
-    
+    def label_components(self):
+        """Flood fill labelling of open areas. Walls get -1, open cells the id of their area. """
+        labels = [[-1]*self.cols for _ in range(self.rows)]
+        count = 0
+        for r in range(self.rows):
+            for c in range(self.cols):
+                if self.grid[r][c] == 1 or labels[r][c] != -1:
+                    continue
+                labels[r][c] = count
+                stack = [(r, c)]
+                while stack:
+                    cr, cc = stack.pop()
+                    for nr, nc in self.get_neighbors(cr, cc):
+                        if self.grid[nr][nc] == 0 and labels[nr][nc] == -1:
+                            labels[nr][nc] = count
+                            stack.append((nr, nc))
+                count += 1
+        return labels, count
+
     def is_fully_connected(self):
-        """Ensure all open cells are reachable using DFS from the start. """
-        visited = set()
-        self.dfs(self.start[0], self.start[1], visited)
+        """Ensure all open cells belong to one area. """
+        return self.label_components()[1] <= 1
+
+    def connect_components(self):
+        """Open walls so that every open area joins the largest one. Linear in the grid size.
+
+        A 0-1 BFS from the largest area finds, for every other area, the path
+        through the fewest walls. Opening the walls on these paths connects
+        the maze; paths share their prefixes, so every cell is opened at most once. """
+        labels, count = self.label_components()
+        if count <= 1:
+            return 0
+
+        sizes = [0]*count
+        for row in labels:
+            for label in row:
+                if label >= 0:
+                    sizes[label] += 1
+        main = sizes.index(max(sizes))
+
+        # Number of walls to break from the main area, walls cost 1 and open cells 0
+        unreached = self.rows*self.cols
+        dist = [[unreached]*self.cols for _ in range(self.rows)]
+        parent = [[None]*self.cols for _ in range(self.rows)]
+        queue = deque()
         for r in range(self.rows):
             for c in range(self.cols):
-                if self.grid[r][c] == 0 and (r, c) not in visited:
-                    return False
-        return True
+                if labels[r][c] == main:
+                    dist[r][c] = 0
+                    queue.append((r, c))
+
+        # Areas in the order the BFS reaches them, with their closest cell
+        reached = [False]*count
+        order = []
+        while queue:
+            r, c = queue.popleft()
+            label = labels[r][c]
+            if label >= 0 and not reached[label]:
+                reached[label] = True
+                order.append((label, (r, c)))
+            for nr, nc in self.get_neighbors(r, c):
+                cost = self.grid[nr][nc]
+                if dist[r][c] + cost < dist[nr][nc]:
+                    dist[nr][nc] = dist[r][c] + cost
+                    parent[nr][nc] = (r, c)
+                    if cost:
+                        queue.append((nr, nc))
+                    else:
+                        queue.appendleft((nr, nc))
+
+        # An area's path only crosses areas reached before it, so it stops at the first open cell
+        opened = 0
+        for label, (r, c) in order:
+            if label == main:
+                continue
+            r, c = parent[r][c]
+            while self.grid[r][c] == 1:
+                self.grid[r][c] = 0
+                opened += 1
+                r, c = parent[r][c]
+        return opened
     
     def generate_maze(self):
         """Generate the maze by removing walls and ensuring connectivity. """
         total_cells = self.rows * self.cols
         target_open_cells = int(total_cells * (1 - self.wall_density))
         open_count = 1  # The start point is already open
-        open_list = [[(random.randrange(0, self.rows//2), random.randrange(0, self.cols//2))],
-                     [(random.randrange(self.rows//2, self.rows), random.randrange(0, self.cols//2))],
-                     [(random.randrange(self.rows//2, self.rows), random.randrange(self.cols//2, self.cols))],
-                     [(random.randrange(0, self.rows//2), random.randrange(self.cols//2, self.cols))]
+        open_list = [[(self.rng.randrange(0, self.rows//2), self.rng.randrange(0, self.cols//2))],
+                     [(self.rng.randrange(self.rows//2, self.rows), self.rng.randrange(0, self.cols//2))],
+                     [(self.rng.randrange(self.rows//2, self.rows), self.rng.randrange(self.cols//2, self.cols))],
+                     [(self.rng.randrange(0, self.rows//2), self.rng.randrange(self.cols//2, self.cols))]
                 ]
         
         while open_count < target_open_cells:
             for corner_list in open_list:
                 if not corner_list:
                     # If the list of open cells is empty, add a new random cell to keep progressing
-                    corner_list.append((random.randint(0, self.rows - 1), random.randint(0, self.cols - 1)))
+                    corner_list.append((self.rng.randint(0, self.rows - 1), self.rng.randint(0, self.cols - 1)))
                     
                 r, c = corner_list.pop()
                 
@@ -79,29 +147,34 @@ class Maze:
                 
                 # Get neighbors and try to open more paths
                 neighbors = self.get_neighbors(r, c)
-                random.shuffle(neighbors)
+                self.rng.shuffle(neighbors)
                 
                 for nr, nc in neighbors:
                     if self.grid[nr][nc] == 1:
                         # Open path with a certain probability
-                        if random.random() > self.fragmentation:
+                        if self.rng.random() > self.fragmentation:
                             corner_list.append((nr, nc))
         
         # Ensure the maze is fully connected
-        while not self.is_fully_connected():
-            # Randomly remove walls to connect isolated areas
-            for r in range(self.rows):
-                for c in range(self.cols):
-                    if self.grid[r][c] == 1:
-                        neighbors = self.get_neighbors(r, c)
-                        open_neighbors = [n for n in neighbors if self.grid[n[0]][n[1]] == 0]
-                        # Remove a wall if it connects two open areas
-                        if len(open_neighbors) >= 2:
-                            self.grid[r][c] = 0
+        self.connect_components()
 
-        return np.array(self.grid)
+        return np.array(self.grid, dtype=np.uint8)
 
     def display(self):
         """Display the maze in the console. """
         for row in self.grid:
             print("".join(["█" if cell == 1 else " " for cell in row]))
+
+
+def generate_maze(map_width: int,
+                  map_height: int,
+                  wall_density: float,
+                  min_wall_density: float,
+                  fragmentation: float,
+                  rng=random) -> np.ndarray:
+    """Generate mazes until one has at least min_wall_density walls. """
+    while(True):
+        maze = Maze(map_width, map_height, wall_density, fragmentation, rng)
+        grid = maze.generate_maze()
+        if np.sum(grid) > grid.size*min_wall_density:
+            return grid
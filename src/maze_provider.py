@@ -0,0 +1,133 @@
+import os
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+import numpy as np
+from maze_generator import generate_maze
+
+# Mazes kept in the cache directory, the least recently used ones beyond this are deleted
+MAX_CACHED_MAZES = 256
+
+def _maze_file(cache_dir: str, key: tuple) -> str:
+    map_width, map_height, wall_density, min_wall_density, fragmentation, seed = key
+    return os.path.join(cache_dir, f"{map_width}x{map_height}_{wall_density}_{min_wall_density}_{fragmentation}_{seed}.npy")
+
+def _prune(cache_dir: str, max_cached: int) -> None:
+    '''Deletes the least recently used mazes beyond max_cached.'''
+    files = []
+    try:
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".npy"):
+                files.append((entry.stat().st_mtime_ns, entry.path))
+    except FileNotFoundError:
+        # Another process deleted a file or the directory at the same time
+        return
+    if len(files) <= max_cached:
+        return
+    files.sort()
+    for _, path in files[:len(files) - max_cached]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _build_maze(cache_dir: Optional[str], key: tuple, max_cached: int = MAX_CACHED_MAZES) -> np.ndarray:
+    '''Generates the maze for a cache key and stores it on disk. Runs in the worker processes.
+
+    Every write prunes the cache, the new file is the most recent and stays.'''
+    map_width, map_height, wall_density, min_wall_density, fragmentation, seed = key
+    grid = generate_maze(map_width, map_height, wall_density, min_wall_density, fragmentation,
+                         random.Random(seed)).astype(np.uint8)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _maze_file(cache_dir, key)
+        # Write under a temporary name first so readers never see half a file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, grid)
+        os.replace(temp_path, path)
+        _prune(cache_dir, max_cached)
+    return grid
+
+
+class MazeProvider:
+    '''Drop-in replacement for generate_maze with a process pool and an on-disk cache.
+
+    A maze is identified by its parameters and a seed drawn from the rng the
+    caller passes, so the same rng state always gives the same grid. Mazes
+    announced with prefetch() are generated in the background, and finished
+    grids are kept as .npy files that are memory-mapped on load. Only the
+    max_cached most recently used files are kept, as every game draws new
+    seeds. With workers=0 mazes are only built when they are asked for.
+    With wait=False a maze the pool has not finished yet is built in
+    process instead, so a caller serving others is not held up by a queue
+    of background work.'''
+    def __init__(self, cache_dir: Optional[str] = None, workers: int = 1, max_cached: int = MAX_CACHED_MAZES,
+                 wait: bool = True) -> None:
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.max_cached = max_cached
+        self.wait = wait
+        self._pool = None
+        self._pending = {}
+
+    def _key(self, map_width, map_height, wall_density, min_wall_density, fragmentation, rng) -> tuple:
+        return (map_width, map_height, wall_density, min_wall_density, fragmentation, rng.getrandbits(32))
+
+    def __call__(self,
+                 map_width: int,
+                 map_height: int,
+                 wall_density: float,
+                 min_wall_density: float,
+                 fragmentation: float,
+                 rng=random) -> np.ndarray:
+        key = self._key(map_width, map_height, wall_density, min_wall_density, fragmentation, rng)
+
+        future = self._pending.pop(key, None)
+        if future is not None and (self.wait or future.done()):
+            try:
+                return future.result()
+            except (BrokenProcessPool, OSError):
+                # A failed worker must not stop the game, the maze is built here instead
+                self.close()
+        if self.cache_dir is not None:
+            path = _maze_file(self.cache_dir, key)
+            try:
+                grid = np.load(path, mmap_mode="r")
+                # The modification time marks when a maze was last used
+                os.utime(path)
+                return grid
+            except FileNotFoundError:
+                pass
+        return _build_maze(self.cache_dir, key, self.max_cached)
+
+    def prefetch(self,
+                 map_width: int,
+                 map_height: int,
+                 wall_density: float,
+                 min_wall_density: float,
+                 fragmentation: float,
+                 rng=random) -> None:
+        '''Starts generating a maze in the background. Pass an rng in the same state as for the later call.'''
+        key = self._key(map_width, map_height, wall_density, min_wall_density, fragmentation, rng)
+        if self.workers == 0 or key in self._pending:
+            return
+        if self.cache_dir is not None and os.path.exists(_maze_file(self.cache_dir, key)):
+            return
+        if self._pool is None:
+            # Forking a process that already runs SDL is unsafe, so workers are spawned
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        try:
+            self._pending[key] = self._pool.submit(_build_maze, self.cache_dir, key, self.max_cached)
+        except BrokenProcessPool:
+            # The maze is built in process when it is asked for
+            self.close()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._pending.clear()
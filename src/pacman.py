@@ -1,218 +1,167 @@
+import os
+import random
 import pygame
 import time
-import random
-import numpy as np
-from maze_generator import Maze
-from characters import Pacman, Dot, Ghost, Bonus
+from collections import deque
+from engine import Engine, MAX_LEVEL
+from assets import load_game_sprites, sprite_cache
+from asset_bundle import AssetBundle
+from renderer import Renderer, ViewportRenderer
+from maze_provider import MazeProvider
+from replay import Replay
+from profiler import Profiler
+from autopilot import Autopilot
 from utils import *
 
-def generate_maze(map_width: int,
-                  map_height: int,
-                  wall_density: float,
-                  min_wall_density: float,
-                  fragmentation: float) -> np.ndarray:
-    while(True):
-        try:
-            maze = Maze(map_width, map_height, wall_density, fragmentation)
-            grid = maze.generate_maze()
-        except Exception:
-            continue
-        if np.sum(grid) > grid.size*min_wall_density:
-            return grid
+# Arrow keys in the order they are checked while held down
+KEY_ACTIONS = ((pygame.K_LEFT, 'left'), (pygame.K_RIGHT, 'right'), (pygame.K_UP, 'up'), (pygame.K_DOWN, 'down'))
+# Ticks simulated before a frame is drawn at most, time beyond that is dropped
+MAX_TICKS_PER_FRAME = 5
+
+def held_action(keys) -> str:
+    '''The command of the arrow key that is held down, None if there is none.'''
+    for key, action in KEY_ACTIONS:
+        if keys[key]:
+            return action
+    return None
 
 def run_pacman_game(screen_width: int,
                     screen_height: int,
-                    map_width: int,
-                    map_height: int,
                     move_delay: int,
-                    wall_density: float,
                     images: dict,
-                    fireball_time: int,
-                    heart_time: int,
-                    max_score: int,
+                    engine_config: dict,
+                    maze_cache: str = None,
+                    fps: int = 60,
+                    replay_dir: str = None,
+                    profile_trace: str = None,
+                    tile_size: int = None,
+                    autopilot: bool = False,
+                    asset_cache: str = None,
                 ):
     
+    # The engine config, see utils.engine_config_from, also sets the size of the maze drawn
+    map_width, map_height = engine_config["map_width"], engine_config["map_height"]
+    max_score = engine_config["max_score"]
+
+    # Time to the first frame is reported to the profiler
+    started = time.perf_counter()
+
     # Initialize Pygame
     pygame.init()
 
     # Set up screen parameters
     screen = pygame.display.set_mode((screen_width, screen_height))
-    field_size = (screen_width//map_width, screen_height//map_height)
-    x_scaling = screen_width//map_width
-    y_scaling = screen_height//map_height
+    field_size = field_size_for(screen_width, screen_height, map_width, map_height, tile_size)
+    # Images pre-scaled for this field size come from the bundle built by asset_bundle.py, if there is one
+    if asset_cache is not None:
+        sprite_cache.bundle = AssetBundle.open(asset_cache, field_size)
 
     # Set the title and icon
     pygame.display.set_caption("Pac-Man")
     image_folder = images["folder"]
-    icon = pygame.image.load(image_folder+images["pacman_icon"])
+    icon = sprite_cache.get(image_folder+images["pacman_icon"], None, convert=None)
     pygame.display.set_icon(icon)
 
-    # Set up the game variables
+    # Phase timings are collected while the overlay (F3) is shown or a trace file is asked for
+    profiler = Profiler(enabled=profile_trace is not None, trace=profile_trace is not None)
+    show_overlay = False
+
+    # Game rules live in the headless engine, this function only draws its state
+    # The next level's maze is generated in the background while this one is played
+    maze_provider = MazeProvider(cache_dir=maze_cache)
+    engine = Engine(**engine_config, maze_provider=maze_provider, profiler=profiler)
+    state = engine.reset()
+    # Every tick's input is recorded, so the game can be played again from its seed
+    replay = Replay.from_engine(engine)
+
+    # Mazes larger than the screen are shown through a camera that follows pacman
+    fits_screen = map_width*field_size[0] <= screen_width and map_height*field_size[1] <= screen_height
+    renderer_class = Renderer if fits_screen else ViewportRenderer
+
+    # Load the images
+    renderer = renderer_class(screen, field_size, load_game_sprites(images, field_size), max_score, MAX_LEVEL, profiler)
+
+    renderer.draw(state)
+    profiler.add('startup', time.perf_counter() - started)
     running = True
-    score = 0
-    level = 1
-
-    # Maze generation
-    grid = generate_maze(map_width, map_height, wall_density, 0.1, level/10)
-
-    # Characters initialization
-    pacman = Pacman(grid, field_size, map_width, map_height, image_folder+images["pacman"])
-    pacman_image = pacman.image
-    dot = Dot(grid, field_size, map_width, map_height, image_folder+images["dot"])
-    dot_image = dot.image
-    fireball = Bonus(grid, field_size, map_width, map_height, image_folder+images["fireball"])
-    fireball.x, fireball.y = -1, -1
-    fireball_image = fireball.image
-    heart = Bonus(grid, field_size, map_width, map_height, image_folder+images["heart"])
-    heart.x, heart.y = -1, -1
-    heart_image = heart.image
-
-    ghost_images = [image_folder+ghost_img for ghost_img in images["ghosts"]]
-    ghost_image = random.choice(ghost_images)
-
-    ghost = Ghost(grid, field_size, map_width, map_height, ghost_image)
-    ghost_image = ghost.image
-
-    # Load the wall images
-    wall_image = pygame.image.load(image_folder+images["wall"])
-    wall_image = pygame.transform.scale(wall_image, field_size)
-    ghost_reverse_image = pygame.image.load(image_folder+images["ghost_reverse"])
-    ghost_reverse_image = pygame.transform.scale(ghost_reverse_image, field_size)
-    
-    ghosts = [ghost]
-    fireball_counter = fireball_time
-    heart_counter = heart_time
+
+    # Events are polled and frames drawn at the display rate, the game ticks every move_delay seconds
+    clock = pygame.time.Clock()
+    key_actions = dict(KEY_ACTIONS)
+    pressed = deque(maxlen=INPUT_BUFFER_SIZE)
+    # F2 hands pacman over to the autopilot and back
+    pilot = Autopilot(random.Random(engine.seed))
+    previous_time = time.perf_counter()
+    lag = 0.0
 
     # Main game loop
     while running:
 
-        # Ghost behaviour mode
-        ghost_mode = 'hunt'
-
-        # To immediate change
-        if fireball_counter == 0: heart_counter += heart_time
-        if heart_counter == 0: fireball_counter += fireball_time
-
-        fireball_counter += 1
-        if fireball_counter < fireball_time:
-            ghost_mode = 'calm'
-        
-        heart_counter += 1
-        if heart_counter < heart_time:
-            ghost_mode = 'fear'
-
-        keys = pygame.key.get_pressed()
-        # Check for pacman input
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        # Check for pacman input, presses shorter than a tick are kept until the next one
+        with profiler.span('events'):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key in key_actions:
+                    pressed.append(key_actions[event.key])
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+                    autopilot = not autopilot
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    show_overlay = not show_overlay
+                    profiler.enabled = show_overlay or profile_trace is not None
+
+        now = time.perf_counter()
+        lag += now - previous_time
+        previous_time = now
+        ticks = min(int(lag // move_delay), MAX_TICKS_PER_FRAME)
+        lag = lag - ticks*move_delay if ticks < MAX_TICKS_PER_FRAME else 0.0
+
+        # Under load several ticks run before the next frame is drawn
+        for _ in range(ticks):
+            if autopilot:
+                action = pilot(state)
+            else:
+                action = pressed.popleft() if pressed else held_action(pygame.key.get_pressed())
+            state, events = engine.step(action)
+            replay.record(action)
+            if not state.running:
                 running = False
-
-        # Pacman behaviour
-        if keys[pygame.K_LEFT]:
-            pacman.make_move(command='left')
-        elif keys[pygame.K_RIGHT]:
-            pacman.make_move(command='right')
-        elif keys[pygame.K_UP]:
-            pacman.make_move(command='up')
-        elif keys[pygame.K_DOWN]:
-            pacman.make_move(command='down')
-        
-        # Update game state
-        if pacman.x == dot.x and pacman.y == dot.y:
-            score += 1
-
-            if score == max_score:
-                grid = generate_maze(map_width, map_height, wall_density, 0.1, level/10)
-                pacman = Pacman(grid, field_size, map_width, map_height, image_folder+images["pacman"])
-                dot = Dot(grid, field_size, map_width, map_height, image_folder+images["dot"])
-                fireball.x, fireball.y = -1, -1
-                heart.x, heart.y = -1, -1
-                ghosts = [Ghost(grid, field_size, map_width, map_height, random.choice(ghost_images))]
-                fireball_counter = fireball_time
-                heart_counter = heart_time
-                score = 0
-                level += 1
-                if level == 11: pygame.quit()
-                continue
-
-            dot = Dot(grid, field_size, map_width, map_height, image_folder+images["dot"])
-
-            if random.randrange(10) == 0:
-                fireball = Bonus(grid, field_size, map_width, map_height, image_folder+images["fireball"])
-            if random.randrange(5) == 0:
-                heart = Bonus(grid, field_size, map_width, map_height, image_folder+images["heart"])
-
-            while(True):
-                new_ghost = Ghost(grid, field_size, map_width, map_height, random.choice(ghost_images))
-                if min(abs(new_ghost.x-pacman.x), abs(new_ghost.y-pacman.y)) > 5:
-                    ghosts.append(new_ghost)
-                    break
-
-        # Fireball catching
-        if pacman.x == fireball.x and pacman.y == fireball.y:
-            fireball_counter = 0
-            fireball.x, fireball.y = -1, -1
-
-        # Heart catching
-        if pacman.x == heart.x and pacman.y == heart.y:
-            heart_counter = 0
-            heart.x, heart.y = -1, -1
-        
-        # Ghost behaviour
-        screen.fill((0, 0, 0))
-        for ghost_id, ghost in enumerate(ghosts):
-            
-            ghost_image = ghost.image
-            if ghost_mode == 'calm':
-                ghost_image = ghost_reverse_image
-
-            if pacman.x == ghost.x and pacman.y == ghost.y:
-                if ghost_mode != 'calm':
-                    pygame.quit()
-                else:
-                    del ghosts[ghost_id]
-                    continue
-
-            screen.blit(ghost_image, (ghost.x*x_scaling, ghost.y*y_scaling))
-            ghosts[ghost_id].make_move(pacman.x, pacman.y, ghost_mode)
+                break
 
         # Draw game
-        screen.blit(pacman_image, (pacman.x*x_scaling, pacman.y*y_scaling))
-        screen.blit(dot_image, (dot.x*x_scaling, dot.y*y_scaling))
-        screen.blit(fireball_image, (fireball.x*x_scaling, fireball.y*y_scaling))
-        screen.blit(heart_image, (heart.x*x_scaling, heart.y*y_scaling))
-        for field_x in range(grid.shape[0]):
-            for field_y in range(grid.shape[1]):
-                if grid[field_x][field_y] == 1:
-                    screen.blit(wall_image, (field_x*x_scaling, field_y*y_scaling))
-
-        font = pygame.font.Font("freesansbold.ttf", 16)
-        text_level = font.render("Level: " + str(level) + " / 10", True, (255, 255, 255))
-        text_score = font.render("Score: " + str(score) + " / 10", True, (255, 255, 255))
-        text_mode = font.render("Mode: " + ghost_mode, True, (255, 255, 255))
-        screen.blit(text_level, (10, 10))
-        screen.blit(text_score, (10, 26))
-        screen.blit(text_mode,  (10, 42))
-        pygame.display.flip()
-        time.sleep(move_delay)
+        if ticks and running:
+            renderer.draw(state, profiler.overlay_lines() if show_overlay else None)
+        profiler.end_frame()
+        clock.tick(fps)
+
+    if replay_dir is not None:
+        replay.finish(state)
+        os.makedirs(replay_dir, exist_ok=True)
+        replay.save(os.path.join(replay_dir, f"{int(time.time())}_{engine.seed}.replay"))
+
+    if profile_trace is not None:
+        profiler.save_trace(profile_trace)
 
     # Quit Pygame
+    maze_provider.close()
     pygame.quit()
 
 
 def main():
-    config = load_config("../configs/config.json")
+    config = load_config()
 
     run_pacman_game(screen_width=config["screen_width"],
                     screen_height=config["screen_height"],
-                    map_width=config["map_width"],
-                    map_height=config["map_height"],
                     move_delay=config["move_delay"],
-                    wall_density=config["wall_density"],
                     images=config["images"],
-                    fireball_time=config["fireball_time"],
-                    heart_time=config["heart_time"],
-                    max_score = config["max_score"],
+                    engine_config=engine_config_from(config),
+                    maze_cache = config.get("maze_cache"),
+                    fps = config.get("fps", 60),
+                    replay_dir = config.get("replay_dir"),
+                    profile_trace = config.get("profile_trace"),
+                    tile_size = config.get("tile_size"),
+                    autopilot = config.get("autopilot", False),
+                    asset_cache = config.get("asset_cache"),
                 )
     
 
@@ -0,0 +1,44 @@
+import importlib
+import random
+from typing import Callable, Optional
+from engine import GameState, ACTIONS
+from utils import MOVE_BITS, MOVE_STEPS
+from autopilot import Autopilot
+
+# A policy factory takes an rng and returns a function from the game state to a pacman command
+Policy = Callable[[GameState], Optional[str]]
+PolicyFactory = Callable[[random.Random], Policy]
+
+def random_policy(rng: random.Random) -> Policy:
+    '''Presses a random arrow key every tick.'''
+    return lambda state: rng.choice(ACTIONS)
+
+def greedy_policy(rng: random.Random) -> Policy:
+    '''Steps towards the dot along the axes, ignoring ghosts, and moves randomly when a wall is in the way.'''
+    def policy(state: GameState) -> Optional[str]:
+        pacman, dot = state.pacman, state.dot
+        possible = state.move_mask[pacman.x, pacman.y]
+        moves = [action for action in ACTIONS if possible & MOVE_BITS[action]]
+        if not moves:
+            return None
+        closer = [action for action in moves
+                  if abs(pacman.x + MOVE_STEPS[action][0] - dot.x) + abs(pacman.y + MOVE_STEPS[action][1] - dot.y)
+                  < abs(pacman.x - dot.x) + abs(pacman.y - dot.y)]
+        return rng.choice(closer or moves)
+    return policy
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+    'autopilot': Autopilot,
+}
+
+def load_policy(name: str) -> PolicyFactory:
+    '''Returns a built-in policy factory, or a plugin one given as "module:function".'''
+    if name in POLICIES:
+        return POLICIES[name]
+    if ":" not in name:
+        raise ValueError(f"Unknown policy {name!r}, use one of {sorted(POLICIES)} or module:function")
+    module_name, function_name = name.split(":", 1)
+    return getattr(importlib.import_module(module_name), function_name)
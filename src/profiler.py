@@ -0,0 +1,100 @@
+import csv
+import json
+import time
+from collections import deque
+from typing import Dict, List
+
+class _Span:
+    '''Adds the time spent inside a with block to one phase of the current frame.'''
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler: 'Profiler', name: str) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self._profiler.add(self._name, time.perf_counter() - self._start)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    '''Collects the time of named phases per frame.
+
+    Phases are timed with `with profiler.span(name):` and summed when a
+    phase runs several times in a frame. end_frame() moves the sums into
+    rolling windows for the overlay and, with trace=True, into a trace that
+    save_trace() writes as csv or json. A disabled profiler hands out one
+    shared no-op span, so the hooks can stay in the code.'''
+    def __init__(self, enabled: bool = False, window: int = 300, trace: bool = False) -> None:
+        self.enabled = enabled
+        self.trace = trace
+        self._window = window
+        self._spans = {}
+        self._current = {}
+        self._history = {}
+        self._frames = []
+        self._frame = 0
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        span = self._spans.get(name)
+        if span is None:
+            span = self._spans[name] = _Span(self, name)
+        return span
+
+    def add(self, name: str, seconds: float) -> None:
+        self._current[name] = self._current.get(name, 0.0) + seconds
+
+    def end_frame(self) -> None:
+        '''Closes the current frame. Phases that did not run in it are not counted.'''
+        self._frame += 1
+        if not self._current:
+            return
+        for name, seconds in self._current.items():
+            history = self._history.get(name)
+            if history is None:
+                history = self._history[name] = deque(maxlen=self._window)
+            history.append(seconds)
+        if self.trace:
+            self._frames.append((self._frame, self._current))
+        self._current = {}
+
+    def percentiles(self) -> Dict[str, tuple]:
+        '''Rolling (p50, p99) in seconds of every phase.'''
+        result = {}
+        for name, history in self._history.items():
+            ordered = sorted(history)
+            result[name] = (ordered[len(ordered)//2], ordered[min(len(ordered)-1, len(ordered)*99//100)])
+        return result
+
+    def overlay_lines(self) -> List[str]:
+        return [f"{name:8s} p50 {p50*1e3:6.2f}ms  p99 {p99*1e3:6.2f}ms"
+                for name, (p50, p99) in sorted(self.percentiles().items())]
+
+    def save_trace(self, path: str) -> None:
+        '''Writes one row per frame with the milliseconds of each phase, as json if path ends with .json, else csv.'''
+        phases = sorted({name for _, frame in self._frames for name in frame})
+        rows = [{"frame": index, **{name: round(frame[name]*1e3, 4) for name in frame}} for index, frame in self._frames]
+        with open(path, "w", newline="") as f:
+            if path.endswith(".json"):
+                json.dump(rows, f)
+            else:
+                writer = csv.DictWriter(f, fieldnames=["frame"] + phases)
+                writer.writeheader()
+                writer.writerows(rows)
@@ -0,0 +1,330 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import pygame
+import numpy as np
+from engine import GameState
+from dynamic_maze import changes_between
+from profiler import Profiler
+
+HUD_POSITION = (10, 10)
+HUD_LINE_HEIGHT = 16
+HUD_COLOR = (255, 255, 255)
+# The performance overlay sits in the top right corner, away from the HUD
+OVERLAY_MARGIN = 10
+OVERLAY_LINE_HEIGHT = 14
+OVERLAY_COLOR = (255, 255, 0)
+# Side of a pre-rendered maze chunk in cells, and how many chunks are kept
+CHUNK_CELLS = 16
+CHUNK_CACHE_SIZE = 64
+
+class Renderer:
+    '''Draws the game state with a cached maze background and dirty rectangles.
+
+    The maze is rendered once per level, walls opened or closed later are
+    patched into it. Each frame only the cells whose sprites or walls
+    changed are restored from the background and redrawn, and only those
+    cells are sent to the display.'''
+    def __init__(self,
+                 screen: pygame.Surface,
+                 field_size: Tuple[int, int],
+                 images: dict,
+                 max_score: int,
+                 max_level: int,
+                 profiler: Optional[Profiler] = None) -> None:
+
+        self._screen = screen
+        self._field_size = field_size
+        self._images = images
+        self._max_score = max_score
+        self._max_level = max_level
+        self._profiler = profiler if profiler is not None else Profiler()
+
+        self._font = pygame.font.Font("freesansbold.ttf", 16)
+        self._hud_key = None
+        self._hud_texts = []
+        self._hud_rect = pygame.Rect(HUD_POSITION, (0, 0))
+        self._overlay_font = pygame.font.Font("freesansbold.ttf", 12)
+        self._overlay_rect = pygame.Rect(0, 0, 0, 0)
+
+        self._grid = None
+        self._wall_head = None
+        self._background = None
+        self._sprites = set()
+
+    def _build_background(self, grid: np.ndarray) -> None:
+        '''Pre-renders the walls of the level.'''
+        x_scaling, y_scaling = self._field_size
+        background = pygame.Surface(self._screen.get_size()).convert()
+        background.fill((0, 0, 0))
+        wall_image = self._images["wall"]
+        background.blits([(wall_image, (field_x*x_scaling, field_y*y_scaling))
+                          for field_x, field_y in np.argwhere(grid == 1)], doreturn=False)
+        self._background = background
+        self._grid = grid
+
+    def _changed_walls(self, state: GameState) -> set:
+        '''Cells opened or closed since the last frame, also when a snapshot took the walls back.'''
+        head = state.walls.head
+        if head is self._wall_head:
+            return set()
+        undo, redo = changes_between(self._wall_head, head)
+        self._wall_head = head
+        return set(undo) | set(redo)
+
+    def _collect_sprites(self,
+                         state: GameState,
+                         view: Optional[pygame.Rect] = None) -> List[Tuple[Tuple[int, int], pygame.Surface]]:
+        '''Returns (cell, image) pairs in drawing order, only those inside view (in cells) if it is given.'''
+        sprites = []
+        ghosts = state.ghosts
+        ghost_x, ghost_y = ghosts.x[:ghosts.count], ghosts.y[:ghosts.count]
+        sprite_ids = ghosts.sprite_id[:ghosts.count]
+        if view is not None:
+            visible = (ghost_x >= view.left) & (ghost_x < view.right) & (ghost_y >= view.top) & (ghost_y < view.bottom)
+            ghost_x, ghost_y, sprite_ids = ghost_x[visible], ghost_y[visible], sprite_ids[visible]
+        for ghost_x, ghost_y, sprite_id in zip(ghost_x.tolist(), ghost_y.tolist(), sprite_ids.tolist()):
+            ghost_image = self._images["ghosts"][sprite_id]
+            if state.ghost_mode == 'calm':
+                ghost_image = self._images["ghost_reverse"]
+            sprites.append(((ghost_x, ghost_y), ghost_image))
+        sprites.append(((state.pacman.x, state.pacman.y), self._images["pacman"]))
+        sprites.append(((state.dot.x, state.dot.y), self._images["dot"]))
+        sprites.append(((state.fireball.x, state.fireball.y), self._images["fireball"]))
+        sprites.append(((state.heart.x, state.heart.y), self._images["heart"]))
+        # Hidden bonuses are kept at (-1, -1)
+        if view is None:
+            return [sprite for sprite in sprites if sprite[0][0] >= 0]
+        return [sprite for sprite in sprites if sprite[0][0] >= 0 and view.collidepoint(sprite[0])]
+
+    def _render_hud(self, state: GameState) -> bool:
+        '''Re-renders HUD text only when level, score or mode changed.'''
+        hud_key = (state.level, state.score, state.ghost_mode)
+        if hud_key == self._hud_key:
+            return False
+        self._hud_key = hud_key
+        self._hud_texts = [
+            self._font.render("Level: " + str(state.level) + " / " + str(self._max_level), True, HUD_COLOR),
+            self._font.render("Score: " + str(state.score) + " / " + str(self._max_score), True, HUD_COLOR),
+            self._font.render("Mode: " + state.ghost_mode, True, HUD_COLOR),
+        ]
+        return True
+
+    def _draw_hud(self) -> pygame.Rect:
+        rects = [self._screen.blit(text, (HUD_POSITION[0], HUD_POSITION[1] + line*HUD_LINE_HEIGHT))
+                 for line, text in enumerate(self._hud_texts)]
+        return rects[0].unionall(rects[1:])
+
+    def _draw_overlay(self, lines: List[str]) -> pygame.Rect:
+        if not lines:
+            return pygame.Rect(0, 0, 0, 0)
+        texts = [self._overlay_font.render(line, True, OVERLAY_COLOR) for line in lines]
+        # One opaque panel, so no wall shows between the lines
+        panel = pygame.Surface((max(text.get_width() for text in texts), len(texts)*OVERLAY_LINE_HEIGHT))
+        panel.blits([(text, (panel.get_width() - text.get_width(), line*OVERLAY_LINE_HEIGHT))
+                     for line, text in enumerate(texts)], doreturn=False)
+        return self._screen.blit(panel, (self._screen.get_width() - OVERLAY_MARGIN - panel.get_width(), OVERLAY_MARGIN))
+
+    def _cells_in_rect(self, rect: pygame.Rect) -> set:
+        if not rect.width or not rect.height:
+            return set()
+        x_scaling, y_scaling = self._field_size
+        return {(field_x, field_y)
+                for field_x in range(rect.left//x_scaling, (rect.right-1)//x_scaling + 1)
+                for field_y in range(rect.top//y_scaling, (rect.bottom-1)//y_scaling + 1)}
+
+    def draw(self, state: GameState, overlay: Optional[List[str]] = None) -> None:
+        '''Draws the state and updates the changed parts of the display.
+
+        overlay holds lines of text drawn on top of everything, like the
+        profiler's phase timings.'''
+        x_scaling, y_scaling = self._field_size
+        profiler = self._profiler
+        sprites = self._collect_sprites(state)
+        with profiler.span('hud'):
+            hud_changed = self._render_hud(state)
+
+        # New level: draw everything once
+        if state.grid is not self._grid:
+            with profiler.span('blit'):
+                self._build_background(state.grid)
+                self._wall_head = state.walls.head
+                self._screen.blit(self._background, (0, 0))
+                self._screen.blits([(image, (cell[0]*x_scaling, cell[1]*y_scaling)) for cell, image in sprites],
+                                   doreturn=False)
+            with profiler.span('hud'):
+                self._hud_rect = self._draw_hud()
+                self._overlay_rect = self._draw_overlay(overlay or [])
+            self._sprites = set(sprites)
+            with profiler.span('display'):
+                pygame.display.flip()
+            return
+
+        # Cells where something appeared, disappeared or changed its image
+        current = set(sprites)
+        dirty_cells = {cell for cell, _ in current ^ self._sprites}
+        self._sprites = current
+        changed_walls = self._changed_walls(state)
+        if changed_walls:
+            with profiler.span('blit'):
+                for x, y in changed_walls:
+                    rect = pygame.Rect(x*x_scaling, y*y_scaling, x_scaling, y_scaling)
+                    self._background.fill((0, 0, 0), rect)
+                    if state.grid[x, y] == 1:
+                        self._background.blit(self._images["wall"], rect)
+            dirty_cells |= changed_walls
+
+        # The HUD is drawn on top, so touching any of its cells means redrawing all of them
+        hud_cells = self._cells_in_rect(self._hud_rect)
+        redraw_hud = hud_changed or not dirty_cells.isdisjoint(hud_cells)
+        if redraw_hud:
+            dirty_cells |= hud_cells
+        # The overlay changes every frame, so the cells below it are always restored
+        dirty_cells |= self._cells_in_rect(self._overlay_rect)
+        if not dirty_cells and not overlay:
+            return
+
+        # Restore the background of dirty cells and redraw the sprites standing there
+        with profiler.span('blit'):
+            rects = [pygame.Rect(cell[0]*x_scaling, cell[1]*y_scaling, x_scaling, y_scaling) for cell in dirty_cells]
+            self._screen.blits([(self._background, rect, rect) for rect in rects], doreturn=False)
+            self._screen.blits([(image, (cell[0]*x_scaling, cell[1]*y_scaling))
+                                for cell, image in sprites if cell in dirty_cells], doreturn=False)
+
+        with profiler.span('hud'):
+            if redraw_hud:
+                hud_rect = self._draw_hud()
+                if hud_changed:
+                    rects.append(self._hud_rect.union(hud_rect))
+                    self._hud_rect = hud_rect
+            if overlay or self._overlay_rect.width:
+                overlay_rect = self._draw_overlay(overlay or [])
+                rects.extend([self._overlay_rect, overlay_rect])
+                self._overlay_rect = overlay_rect
+
+        with profiler.span('display'):
+            pygame.display.update(rects)
+
+
+class ChunkCache:
+    '''Pre-rendered walls of square blocks of the maze, built when first needed.
+
+    Only the most recently used chunks are kept, so memory does not grow
+    with the size of the maze.'''
+    def __init__(self,
+                 wall_image: pygame.Surface,
+                 field_size: Tuple[int, int],
+                 chunk_cells: int = CHUNK_CELLS,
+                 capacity: int = CHUNK_CACHE_SIZE) -> None:
+
+        self._wall_image = wall_image
+        self._field_size = field_size
+        self.chunk_cells = chunk_cells
+        self._capacity = capacity
+        self._chunks = OrderedDict()
+        self._grid = None
+
+    def set_grid(self, grid: np.ndarray) -> None:
+        '''Switches to the maze of a new level and drops all chunks.'''
+        self._grid = grid
+        self._chunks.clear()
+
+    def update(self, cells: set) -> None:
+        '''Redraws cells whose wall was opened or closed, in the chunks that are kept.'''
+        x_scaling, y_scaling = self._field_size
+        size = self.chunk_cells
+        for x, y in cells:
+            chunk = self._chunks.get((x//size, y//size))
+            if chunk is not None:
+                rect = pygame.Rect(x % size*x_scaling, y % size*y_scaling, x_scaling, y_scaling)
+                chunk.fill((0, 0, 0), rect)
+                if self._grid[x, y] == 1:
+                    chunk.blit(self._wall_image, rect)
+
+    def get(self, chunk_x: int, chunk_y: int) -> pygame.Surface:
+        key = (chunk_x, chunk_y)
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            chunk = self._chunks[key] = self._build(chunk_x, chunk_y)
+            if len(self._chunks) > self._capacity:
+                self._chunks.popitem(last=False)
+        else:
+            self._chunks.move_to_end(key)
+        return chunk
+
+    def _build(self, chunk_x: int, chunk_y: int) -> pygame.Surface:
+        x_scaling, y_scaling = self._field_size
+        cells = self.chunk_cells
+        chunk = pygame.Surface((cells*x_scaling, cells*y_scaling)).convert()
+        chunk.fill((0, 0, 0))
+        walls = np.argwhere(self._grid[chunk_x*cells:(chunk_x+1)*cells, chunk_y*cells:(chunk_y+1)*cells] == 1)
+        chunk.blits([(self._wall_image, (field_x*x_scaling, field_y*y_scaling)) for field_x, field_y in walls],
+                    doreturn=False)
+        return chunk
+
+
+class ViewportRenderer(Renderer):
+    '''Draws the part of a large maze around pacman at a fixed tile size.
+
+    The camera keeps pacman in the middle of the screen unless that would
+    show space beyond the maze. Walls come from a ChunkCache and only the
+    visible chunks and characters are drawn, so the cost of a frame depends
+    on the screen size and not on the maze size.'''
+    def __init__(self,
+                 screen: pygame.Surface,
+                 field_size: Tuple[int, int],
+                 images: dict,
+                 max_score: int,
+                 max_level: int,
+                 profiler: Optional[Profiler] = None,
+                 chunk_cells: int = CHUNK_CELLS,
+                 chunk_cache_size: int = CHUNK_CACHE_SIZE) -> None:
+
+        super().__init__(screen, field_size, images, max_score, max_level, profiler)
+        self._chunks = ChunkCache(images["wall"], field_size, chunk_cells, chunk_cache_size)
+        # Size of the screen in cells, a partly visible cell at the border counts
+        self._view_size = (-(-screen.get_width()//field_size[0]), -(-screen.get_height()//field_size[1]))
+
+    def camera(self, state: GameState) -> pygame.Rect:
+        '''The cells on screen, centered on pacman and kept inside the maze.'''
+        map_width, map_height = state.grid.shape
+        view_width, view_height = self._view_size
+        left = min(max(state.pacman.x - view_width//2, 0), max(map_width - view_width, 0))
+        top = min(max(state.pacman.y - view_height//2, 0), max(map_height - view_height, 0))
+        return pygame.Rect(left, top, view_width, view_height)
+
+    def draw(self, state: GameState, overlay: Optional[List[str]] = None) -> None:
+        x_scaling, y_scaling = self._field_size
+        profiler = self._profiler
+        if state.grid is not self._grid:
+            self._chunks.set_grid(state.grid)
+            self._grid = state.grid
+            self._wall_head = state.walls.head
+        changed_walls = self._changed_walls(state)
+        if changed_walls:
+            with profiler.span('blit'):
+                self._chunks.update(changed_walls)
+
+        view = self.camera(state)
+        offset_x, offset_y = view.left*x_scaling, view.top*y_scaling
+        cells = self._chunks.chunk_cells
+        chunk_width, chunk_height = cells*x_scaling, cells*y_scaling
+        map_width, map_height = state.grid.shape
+
+        with profiler.span('blit'):
+            self._screen.fill((0, 0, 0))
+            self._screen.blits([(self._chunks.get(chunk_x, chunk_y),
+                                 (chunk_x*chunk_width - offset_x, chunk_y*chunk_height - offset_y))
+                                for chunk_x in range(view.left//cells, (min(view.right, map_width)-1)//cells + 1)
+                                for chunk_y in range(view.top//cells, (min(view.bottom, map_height)-1)//cells + 1)],
+                               doreturn=False)
+            self._screen.blits([(image, (cell[0]*x_scaling - offset_x, cell[1]*y_scaling - offset_y))
+                                for cell, image in self._collect_sprites(state, view)], doreturn=False)
+
+        with profiler.span('hud'):
+            self._render_hud(state)
+            self._draw_hud()
+            if overlay:
+                self._draw_overlay(overlay)
+
+        with profiler.span('display'):
+            pygame.display.flip()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import struct
+import time
+from typing import List, Optional
+from engine import Engine, GameState, ACTIONS
+from maze_provider import MazeProvider
+
+# Input byte of every tick: 0 stands still, 1-4 follow the order of engine.ACTIONS
+ACTION_CODES = {None: 0, **{action: code+1 for code, action in enumerate(ACTIONS)}}
+CODE_ACTIONS = (None,) + ACTIONS
+
+MAGIC = b"PMRP"
+# Version 2: ghosts stepping onto pacman catch him, version 1 games play out differently
+VERSION = 2
+# magic, version, seed, final level, final score, number of ticks, length of the config json
+HEADER = struct.Struct("<4sBQHIIH")
+
+# Engine arguments stored with a replay, everything else follows from the seed
+ENGINE_CONFIG = ("map_width", "map_height", "wall_density", "fireball_time", "heart_time", "max_score", "ghost_sprites",
+                 "dynamic_walls")
+
+class Replay:
+    '''A recorded game: the seed, the engine settings, one input byte per tick and the final result.'''
+    def __init__(self, seed: int, config: dict, actions: bytes = b"", level: int = 1, score: int = 0) -> None:
+        self.seed = seed
+        self.config = config
+        self.actions = bytearray(actions)
+        self.level = level
+        self.score = score
+
+    @classmethod
+    def from_engine(cls, engine: Engine) -> 'Replay':
+        '''Starts an empty recording of the game the engine was last reset to.'''
+        return cls(engine.seed, {name: getattr(engine, name) for name in ENGINE_CONFIG})
+
+    def record(self, action: Optional[str]) -> None:
+        self.actions.append(ACTION_CODES[action])
+
+    def finish(self, state: GameState) -> None:
+        self.level = state.level
+        self.score = state.score
+
+    def to_bytes(self) -> bytes:
+        config = json.dumps(self.config, separators=(",", ":")).encode()
+        header = HEADER.pack(MAGIC, VERSION, self.seed, self.level, self.score, len(self.actions), len(config))
+        return header + config + bytes(self.actions)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Replay':
+        magic, version, seed, level, score, ticks, config_size = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a replay file or an unsupported version")
+        start = HEADER.size + config_size
+        config = json.loads(data[HEADER.size:start])
+        if len(data) != start + ticks:
+            raise ValueError("Replay file is truncated")
+        return cls(seed, config, data[start:], level, score)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'Replay':
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+
+def play(replay: Replay, maze_provider: Optional[MazeProvider] = None) -> GameState:
+    '''Re-simulates a recorded game without rendering or waiting and returns its last state.'''
+    engine = Engine(**replay.config, maze_provider=maze_provider)
+    state = engine.reset(replay.seed)
+    for code in replay.actions:
+        state, _ = engine.step(CODE_ACTIONS[code])
+    return state
+
+def verify(replay: Replay, maze_provider: Optional[MazeProvider] = None) -> bool:
+    '''Checks that playing the replay again ends with the recorded level and score.'''
+    state = play(replay, maze_provider)
+    return (state.level, state.score) == (replay.level, replay.score)
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Re-simulate recorded games and check their results.")
+    parser.add_argument("replays", nargs="+", help="replay files")
+    parser.add_argument("--maze-cache", default=None, help="directory of cached mazes")
+    args = parser.parse_args(args)
+
+    maze_provider = MazeProvider(cache_dir=args.maze_cache, workers=0)
+    failed = 0
+    ticks = 0
+    start = time.perf_counter()
+    for path in args.replays:
+        replay = Replay.load(path)
+        ticks += len(replay.actions)
+        if not verify(replay, maze_provider):
+            failed += 1
+            print(f"MISMATCH {path}")
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(args.replays)-failed}/{len(args.replays)} replays match, {ticks} ticks in {elapsed:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
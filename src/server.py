@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import json
+from collections import deque
+from typing import Dict, List, Optional
+import numpy as np
+from engine import Engine, ACTIONS
+from dynamic_maze import changes_between
+from maze_provider import MazeProvider
+from profiler import Profiler
+from utils import DEFAULT_CONFIG, INPUT_BUFFER_SIZE, engine_config_from, load_config
+
+# Clients that let this many bytes of updates pile up are disconnected
+MAX_CLIENT_BUFFER = 1 << 20
+# Seconds between two server statistics lines
+STATS_INTERVAL = 10.0
+
+def _cell(character) -> Optional[List[int]]:
+    '''Position of a dot or bonus, None while it is off the map.'''
+    return [character.x, character.y] if character.x >= 0 else None
+
+def _encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class Room:
+    '''One game and the clients playing it.
+
+    Every client of a room steers the same pacman, presses are buffered
+    like in the local game. After each tick the room builds one update for
+    all its clients: a "full" message with the grid on joining, on a new
+    level and on a new game, otherwise a "tick" message with only what
+    changed since the previous tick, including opened and closed walls.'''
+    def __init__(self, name: str, engine: Engine, seed: Optional[int] = None) -> None:
+        self.name = name
+        self.engine = engine
+        self.clients = set()
+        self.games = 0
+        self._pressed = deque(maxlen=INPUT_BUFFER_SIZE)
+        self._held = None
+        self._restart(seed)
+
+    def _restart(self, seed: Optional[int] = None) -> None:
+        self.engine.reset(seed)
+        self.games += 1
+        self._remember()
+
+    def command(self, action: Optional[str]) -> None:
+        '''A press of an arrow key, which is also held until a None command releases it.'''
+        if action is not None:
+            self._pressed.append(action)
+        self._held = action
+
+    def step(self) -> bytes:
+        '''Plays one tick and returns the update for the clients.'''
+        if not self.engine.state.running:
+            self._restart()
+            return _encode(self.full_message())
+
+        action = self._pressed.popleft() if self._pressed else self._held
+        state, events = self.engine.step(action)
+        if 'level' in events:
+            self._remember()
+            return _encode(self.full_message(events))
+        return _encode(self._delta(events))
+
+    def full_message(self, events: Optional[List[str]] = None) -> dict:
+        '''The whole state, the grid as one string of 0 (open) and 1 (wall) per row.'''
+        state = self.engine.state
+        ghosts = state.ghosts
+        count = ghosts.count
+        rows = (state.grid.T + ord('0')).astype(np.uint8)
+        return {
+            "type": "full",
+            "game": self.games,
+            "tick": state.tick,
+            "level": state.level,
+            "score": state.score,
+            "mode": state.ghost_mode,
+            "running": state.running,
+            "events": events or [],
+            "grid": [row.tobytes().decode() for row in rows],
+            "pacman": [state.pacman.x, state.pacman.y],
+            "dot": _cell(state.dot),
+            "fireball": _cell(state.fireball),
+            "heart": _cell(state.heart),
+            "ghosts": np.stack([ghosts.id[:count], ghosts.x[:count], ghosts.y[:count],
+                                ghosts.sprite_id[:count]], axis=1).tolist(),
+        }
+
+    def _remember(self) -> None:
+        '''Keeps the state the next delta is taken against.'''
+        state = self.engine.state
+        ghosts = state.ghosts
+        self._pacman = [state.pacman.x, state.pacman.y]
+        self._items = {name: _cell(getattr(state, name)) for name in ("dot", "fireball", "heart")}
+        self._mode = state.ghost_mode
+        self._score = state.score
+        self._wall_head = state.walls.head
+        self._ghost_id = ghosts.id[:ghosts.count].copy()
+        self._ghost_x = ghosts.x[:ghosts.count].copy()
+        self._ghost_y = ghosts.y[:ghosts.count].copy()
+
+    def _delta(self, events: List[str]) -> dict:
+        state = self.engine.state
+        message = {"type": "tick", "tick": state.tick}
+        moved, spawned, removed = {}, {}, {}
+
+        pacman = [state.pacman.x, state.pacman.y]
+        if pacman != self._pacman:
+            moved["pacman"] = pacman
+        # A dot or bonus at a new cell was spawned there, one that left the map was removed
+        for name, cell in self._items.items():
+            new_cell = _cell(getattr(state, name))
+            if new_cell != cell:
+                if new_cell is None:
+                    removed.setdefault("items", []).append(name)
+                else:
+                    spawned[name] = new_cell
+        if state.ghost_mode != self._mode:
+            message["mode"] = state.ghost_mode
+        if state.score != self._score:
+            message["score"] = state.score
+        if state.walls.head is not self._wall_head:
+            undo, redo = changes_between(self._wall_head, state.walls.head)
+            message["walls"] = [[x, y, state.grid.item(x, y)] for x, y in sorted(set(undo) | set(redo))]
+
+        ghosts = state.ghosts
+        count = ghosts.count
+        ids, xs, ys = ghosts.id[:count], ghosts.x[:count], ghosts.y[:count]
+        if np.array_equal(ids, self._ghost_id):
+            # Most ticks no ghost appears or is eaten
+            old = new = slice(None)
+        else:
+            # Ghost ids are sorted, so old and new ghosts are matched without a python loop
+            _, old, new = np.intersect1d(self._ghost_id, ids, assume_unique=True, return_indices=True)
+            gone = np.setdiff1d(self._ghost_id, ids, assume_unique=True)
+            if len(gone):
+                removed["ghosts"] = gone.tolist()
+            born = np.flatnonzero(~np.isin(ids, self._ghost_id, assume_unique=True))
+            if len(born):
+                spawned["ghosts"] = np.stack([ids[born], xs[born], ys[born], ghosts.sprite_id[born]], axis=1).tolist()
+        changed = np.flatnonzero((self._ghost_x[old] != xs[new]) | (self._ghost_y[old] != ys[new]))
+        if len(changed):
+            new = np.arange(count)[new][changed]
+            moved["ghosts"] = np.stack([ids[new], xs[new], ys[new]], axis=1).tolist()
+
+        for key, part in (("moved", moved), ("spawned", spawned), ("removed", removed)):
+            if part:
+                message[key] = part
+        if events:
+            message["events"] = events
+        if not state.running:
+            message["running"] = False
+        self._remember()
+        return message
+
+
+class GameServer:
+    '''Runs many rooms on one asyncio event loop.
+
+    Clients connect over TCP and exchange json lines: {"join": room name}
+    enters a room (made on first use, {"seed": n} fixes its first game) and
+    {"action": "left"} presses an arrow, {"action": null} releases it. One
+    task ticks every room at the same moments, so the number of timers
+    does not grow with the number of rooms. Rooms without clients are
+    dropped.'''
+    def __init__(self, engine_config: dict, tick_time: float, maze_provider: Optional[MazeProvider] = None,
+                 max_rooms: int = 1000) -> None:
+        self.engine_config = engine_config
+        self.tick_time = tick_time
+        self.maze_provider = maze_provider if maze_provider is not None else MazeProvider(workers=0)
+        self.max_rooms = max_rooms
+        self.rooms: Dict[str, Room] = {}
+        self.profiler = Profiler(enabled=True)
+        self.ticks = 0
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, stats: bool = False) -> None:
+        server = await asyncio.start_server(self._handle, host, port)
+        tasks = [asyncio.create_task(self.run_ticks())]
+        if stats:
+            tasks.append(asyncio.create_task(self._print_stats()))
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.maze_provider.close()
+
+    async def run_ticks(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick_time
+            delay = next_tick - loop.time()
+            if delay < 0:
+                # Behind schedule, the missed ticks are dropped instead of played in a burst
+                next_tick -= delay
+                delay = 0
+            await asyncio.sleep(delay)
+            self.tick()
+
+    def tick(self) -> None:
+        '''Steps every room once and sends the updates.'''
+        self.ticks += 1
+        with self.profiler.span('tick'):
+            for room in list(self.rooms.values()):
+                update = room.step()
+                for writer in list(room.clients):
+                    self._send(writer, update)
+        self.profiler.end_frame()
+
+    def _send(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        # Writes are buffered by the transport, the loop never waits for a slow client
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+            writer.close()
+            return
+        writer.write(data)
+
+    def join(self, writer: asyncio.StreamWriter, name: str, seed: Optional[int] = None) -> Room:
+        room = self.rooms.get(name)
+        if room is None:
+            if len(self.rooms) >= self.max_rooms:
+                raise ValueError("The server is full")
+            engine = Engine(**self.engine_config, maze_provider=self.maze_provider)
+            room = self.rooms[name] = Room(name, engine, seed)
+        room.clients.add(writer)
+        self._send(writer, _encode(room.full_message()))
+        return room
+
+    def leave(self, writer: asyncio.StreamWriter, room: Room) -> None:
+        room.clients.discard(writer)
+        if not room.clients and self.rooms.get(room.name) is room:
+            del self.rooms[room.name]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        room = None
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                    if "join" in message:
+                        if room is not None:
+                            self.leave(writer, room)
+                            room = None
+                        seed = message.get("seed")
+                        room = self.join(writer, str(message["join"]), int(seed) if seed is not None else None)
+                    elif "action" in message:
+                        if message["action"] not in ACTIONS + (None,):
+                            raise ValueError(f"Unknown action {message['action']!r}")
+                        if room is not None:
+                            room.command(message["action"])
+                except (ValueError, TypeError, AttributeError) as error:
+                    self._send(writer, _encode({"type": "error", "message": str(error)}))
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            if room is not None:
+                self.leave(writer, room)
+            writer.close()
+
+    async def _print_stats(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            clients = sum(len(room.clients) for room in self.rooms.values())
+            p50, p99 = self.profiler.percentiles().get('tick', (0.0, 0.0))
+            print(f"{len(self.rooms)} rooms, {clients} clients, tick p50 {p50*1e3:.2f}ms p99 {p99*1e3:.2f}ms")
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Host many pacman games for network clients, see client.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--max-rooms", type=int, default=1000)
+    parser.add_argument("--maze-workers", type=int, default=1, help="processes generating the next levels' mazes")
+    parser.add_argument("--stats", action="store_true", help=f"print rooms, clients and tick times every {STATS_INTERVAL:.0f}s")
+    args = parser.parse_args(args)
+
+    config = load_config(args.config)
+    engine_config = engine_config_from(config)
+    # Rooms are stepped on the event loop, so a level switch must not wait for the maze pool
+    maze_provider = MazeProvider(cache_dir=config.get("maze_cache"), workers=args.maze_workers, wait=False)
+    server = GameServer(engine_config, config["move_delay"], maze_provider, args.max_rooms)
+    print(f"Serving on {args.host}:{args.port}")
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.stats))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+from array import array
+from typing import Optional, Tuple
+import numpy as np
+
+class SpawnIndex:
+    '''Open cells of a level together with the cells taken by characters.
+
+    Open cells are kept in one list whose first part holds the free cells,
+    so occupying, releasing and sampling a free cell are all O(1). The
+    lists are flat int arrays, so copy() is a few memory copies.'''
+    def __init__(self, grid: np.ndarray) -> None:
+        self._height = grid.shape[1]
+        # Cells are stored as flat ids x*height + y
+        cells = np.flatnonzero(np.asarray(grid) == 0).astype(np.intc)
+        self._cells = array('i', cells.tobytes())
+        slot = np.full(grid.size, -1, dtype=np.intc)
+        slot[cells] = np.arange(len(cells), dtype=np.intc)
+        self._slot = array('i', slot.tobytes())
+        self._occupants = array('i', bytes(4*grid.size))
+        self._free = len(self._cells)
+
+    def copy(self) -> 'SpawnIndex':
+        spawn_index = SpawnIndex.__new__(SpawnIndex)
+        spawn_index._height = self._height
+        spawn_index._cells = self._cells[:]
+        spawn_index._slot = self._slot[:]
+        spawn_index._occupants = self._occupants[:]
+        spawn_index._free = self._free
+        return spawn_index
+
+    @property
+    def free_count(self) -> int:
+        return self._free
+
+    def is_free(self, x: int, y: int) -> bool:
+        cell = x*self._height + y
+        return self._slot[cell] >= 0 and self._occupants[cell] == 0
+
+    def occupants(self, x: int, y: int) -> int:
+        '''Number of characters standing on the cell.'''
+        return self._occupants[x*self._height + y]
+
+    def _swap(self, slot: int, other_slot: int) -> None:
+        cell, other = self._cells[slot], self._cells[other_slot]
+        self._cells[slot], self._cells[other_slot] = other, cell
+        self._slot[cell], self._slot[other] = other_slot, slot
+
+    def occupy(self, x: int, y: int) -> None:
+        '''Marks one more character standing on the cell. Cells off the map are ignored.'''
+        if x < 0:
+            return
+        cell = x*self._height + y
+        self._occupants[cell] += 1
+        if self._occupants[cell] == 1:
+            self._free -= 1
+            self._swap(self._slot[cell], self._free)
+
+    def release(self, x: int, y: int) -> None:
+        '''Marks one character less standing on the cell.'''
+        if x < 0:
+            return
+        cell = x*self._height + y
+        self._occupants[cell] -= 1
+        if self._occupants[cell] == 0:
+            self._swap(self._slot[cell], self._free)
+            self._free += 1
+
+    def move(self, old_x: int, old_y: int, x: int, y: int) -> None:
+        if (old_x, old_y) != (x, y):
+            self.release(old_x, old_y)
+            self.occupy(x, y)
+
+    def open_cell(self, x: int, y: int) -> None:
+        '''Adds a wall that opened as a free cell.'''
+        cell = x*self._height + y
+        self._cells.append(cell)
+        self._slot[cell] = len(self._cells) - 1
+        self._swap(len(self._cells) - 1, self._free)
+        self._free += 1
+
+    def close_cell(self, x: int, y: int) -> None:
+        '''Removes a free cell that became a wall.'''
+        cell = x*self._height + y
+        # The cell goes to the end of the free part, then to the very end
+        self._free -= 1
+        self._swap(self._slot[cell], self._free)
+        self._swap(self._free, len(self._cells) - 1)
+        self._cells.pop()
+        self._slot[cell] = -1
+
+    def sample(self,
+               rng,
+               away_from: Optional[Tuple[int, int]] = None,
+               distance: int = 0,
+               tries: int = 16) -> Optional[Tuple[int, int]]:
+        '''Returns a random free cell, or None when there is no valid one.
+
+        With away_from the cell must be more than distance cells away from it
+        along both axes. Up to tries random draws look for one first. Only
+        when they all fail does one vectorized pass over the free cells pick
+        among the valid ones, so None always means there is no valid cell.
+        While at least half of the free cells are valid, the pass runs with
+        probability below 2**-tries and the expected cost stays O(1).'''
+        if self._free == 0:
+            return None
+        if away_from is None:
+            return divmod(self._cells[rng.randrange(self._free)], self._height)
+
+        away_x, away_y = away_from
+        for _ in range(tries):
+            x, y = divmod(self._cells[rng.randrange(self._free)], self._height)
+            if abs(x-away_x) > distance and abs(y-away_y) > distance:
+                return (x, y)
+
+        free = np.frombuffer(self._cells, dtype=np.intc)[:self._free]
+        xs, ys = np.divmod(free, self._height)
+        valid = free[(np.abs(xs-away_x) > distance) & (np.abs(ys-away_y) > distance)]
+        if not len(valid):
+            return None
+        return divmod(int(valid[rng.randrange(len(valid))]), self._height)
+
+    def sample_open(self, rng) -> Tuple[int, int]:
+        '''Returns a random open cell, taken or not.'''
+        return divmod(self._cells[rng.randrange(len(self._cells))], self._height)
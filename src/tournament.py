@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
+from engine import Engine
+from maze_provider import MazeProvider
+from policies import load_policy
+from utils import DEFAULT_CONFIG, ENGINE_KEYS, engine_config_from, load_config
+
+# Engine and policy of a worker process, set up once and reused for all its games
+_worker = {}
+
+def _init_worker(engine_config: dict, policy_name: str, max_ticks: int, maze_cache: Optional[str]) -> None:
+    _worker["engine"] = Engine(**engine_config, maze_provider=MazeProvider(cache_dir=maze_cache, workers=0))
+    _worker["policy_factory"] = load_policy(policy_name)
+    _worker["max_ticks"] = max_ticks
+
+def play_game(seed: int) -> dict:
+    '''Plays one game in the worker process and returns its result.'''
+    engine = _worker["engine"]
+    policy = _worker["policy_factory"](random.Random(seed))
+    start = time.perf_counter()
+    state = engine.reset(seed)
+    dots = 0
+    ghosts_eaten = 0
+    outcome = "timeout"
+    while state.tick < _worker["max_ticks"]:
+        state, events = engine.step(policy(state))
+        dots += events.count('dot')
+        ghosts_eaten += events.count('ghost_eaten')
+        if 'win' in events:
+            outcome = "win"
+        elif 'death' in events:
+            # Caught while the ghosts were hunting or while they were running away from pacman
+            outcome = f"death_{state.ghost_mode}"
+        if not state.running:
+            break
+
+    return {
+        "seed": seed,
+        "level": state.level,
+        "score": state.score,
+        "dots": dots,
+        "ghosts_eaten": ghosts_eaten,
+        "ticks": state.tick,
+        "outcome": outcome,
+        "seconds": time.perf_counter() - start,
+        "worker": os.getpid(),
+    }
+
+
+def summarize(results: List[dict]) -> dict:
+    '''Aggregates game results into the statistics printed at the end of a tournament.'''
+    dots = sorted(result["dots"] for result in results)
+    worker_ticks = defaultdict(int)
+    worker_seconds = defaultdict(float)
+    for result in results:
+        worker_ticks[result["worker"]] += result["ticks"]
+        worker_seconds[result["worker"]] += result["seconds"]
+
+    return {
+        "games": len(results),
+        "outcomes": dict(Counter(result["outcome"] for result in results)),
+        "levels": dict(sorted(Counter(result["level"] for result in results).items())),
+        "dots": {
+            "mean": statistics.mean(dots),
+            "p10": dots[len(dots)//10],
+            "p50": dots[len(dots)//2],
+            "p90": dots[len(dots)*9//10],
+            "max": dots[-1],
+        },
+        "ghosts_eaten": sum(result["ghosts_eaten"] for result in results),
+        "ticks_per_second": {str(worker): worker_ticks[worker] / worker_seconds[worker]
+                             for worker in worker_ticks if worker_seconds[worker] > 0},
+    }
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Play many headless games with a pacman policy and report statistics.")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0, help="game i is played with seed + i")
+    parser.add_argument("--policy", default="greedy", help="built-in policy name or module:function")
+    parser.add_argument("--max-ticks", type=int, default=10000, help="games running longer end as timeouts")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--maze-cache", default=None, help="directory of cached mazes shared by the workers")
+    parser.add_argument("--output", default=None, help="json lines file receiving every result as it completes")
+    parser.add_argument("--summary", default=None, help="json file for the aggregated statistics")
+    for name in ("map_width", "map_height", "max_score", "fireball_time", "heart_time"):
+        parser.add_argument("--" + name.replace("_", "-"), type=int, default=None)
+    parser.add_argument("--wall-density", type=float, default=None)
+    parser.add_argument("--dynamic-walls", action="store_true", help="open and close walls during levels")
+    args = parser.parse_args(args)
+
+    config = load_config(args.config)
+    overrides = {name: getattr(args, name) for name in ENGINE_KEYS if getattr(args, name) is not None}
+    if args.dynamic_walls:
+        overrides["dynamic_walls"] = True
+    engine_config = engine_config_from(config, overrides)
+    try:
+        load_policy(args.policy)
+    except (ValueError, ImportError, AttributeError) as error:
+        parser.error(str(error))
+
+    results = []
+    output = open(args.output, "w") if args.output else None
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(engine_config, args.policy, args.max_ticks, args.maze_cache)) as pool:
+        futures = [pool.submit(play_game, args.seed + game) for game in range(args.games)]
+        # Results stream back in the order the games finish
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+            if done % max(1, args.games//20) == 0 or done == args.games:
+                print(f"{done}/{args.games} games, {time.perf_counter() - start:.1f}s")
+    if output is not None:
+        output.close()
+
+    summary = summarize(results)
+    summary["config"] = engine_config
+    summary["policy"] = args.policy
+    print(json.dumps(summary, indent=2))
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,4 +1,24 @@
 import json
+import os
+import numpy as np
+
+# Config files and the paths inside them are found from here, so scripts run from any directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG = os.path.join(ROOT_DIR, "configs", "config.json")
+# Config entries holding paths, relative ones start at the config file's folder
+PATH_KEYS = ("maze_cache", "replay_dir", "profile_trace", "asset_cache")
+
+# Config entries passed on to the Engine
+ENGINE_KEYS = ("map_width", "map_height", "wall_density", "fireball_time", "heart_time", "max_score")
+
+# Key presses the local game and the server keep for the next ticks, older ones are
+# dropped so input never lags behind
+INPUT_BUFFER_SIZE = 3
+
+# Bits of the per-cell move mask
+UP, DOWN, LEFT, RIGHT = 1, 2, 4, 8
+MOVE_BITS = {'up': UP, 'down': DOWN, 'left': LEFT, 'right': RIGHT}
+MOVE_STEPS = {'up': (0, -1), 'down': (0, 1), 'left': (-1, 0), 'right': (1, 0)}
 
 def is_up_possible(object_x, object_y, width, height, grid):
     if object_y == 0:
@@ -28,6 +48,51 @@ def is_right_possible(object_x, object_y, width, height, grid):
         return False
     return True
 
-def load_config(config_path: str) -> dict:
+def build_move_mask(grid: np.ndarray) -> np.ndarray:
+    """Per-cell bit mask of the possible moves, one lookup answers all four is_*_possible checks."""
+    is_open = np.asarray(grid) == 0
+    mask = np.zeros(is_open.shape, dtype=np.uint8)
+    mask[:, 1:] |= np.where(is_open[:, :-1], UP, 0).astype(np.uint8)
+    mask[:, :-1] |= np.where(is_open[:, 1:], DOWN, 0).astype(np.uint8)
+    mask[1:, :] |= np.where(is_open[:-1, :], LEFT, 0).astype(np.uint8)
+    mask[:-1, :] |= np.where(is_open[1:, :], RIGHT, 0).astype(np.uint8)
+    return mask
+
+def update_move_mask(grid: np.ndarray, move_mask: np.ndarray, x: int, y: int) -> None:
+    """Follows a cell that opened or closed: only the neighbours' moves into it change."""
+    width, height = grid.shape
+    is_open = grid.item(x, y) == 0
+    # Neighbour offset and the bit of its move back into the cell
+    for dx, dy, bit in ((0, -1, DOWN), (0, 1, UP), (-1, 0, RIGHT), (1, 0, LEFT)):
+        if 0 <= x + dx < width and 0 <= y + dy < height:
+            if is_open:
+                move_mask[x + dx, y + dy] |= bit
+            else:
+                move_mask[x + dx, y + dy] &= (UP | DOWN | LEFT | RIGHT) ^ bit
+
+def load_config(config_path: str = DEFAULT_CONFIG) -> dict:
+    """Reads a config file and turns its relative paths into absolute ones."""
     with open(config_path, "r") as f:
-        return json.load(f)
\ No newline at end of file
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(config_path))
+    for key in PATH_KEYS:
+        if config.get(key) is not None:
+            config[key] = os.path.normpath(os.path.join(base, config[key]))
+    if "images" in config:
+        # The folder is joined to file names with +, so it keeps its trailing separator
+        config["images"]["folder"] = os.path.join(os.path.normpath(os.path.join(base, config["images"]["folder"])), "")
+    return config
+
+def engine_config_from(config: dict, overrides: dict = None) -> dict:
+    """Engine arguments from a loaded config, overrides replace the config's values."""
+    engine_config = {name: config[name] for name in ENGINE_KEYS}
+    engine_config["ghost_sprites"] = len(config["images"]["ghosts"])
+    engine_config["dynamic_walls"] = config.get("dynamic_walls", False)
+    engine_config.update(overrides or {})
+    return engine_config
+
+def field_size_for(screen_width: int, screen_height: int, map_width: int, map_height: int, tile_size=None) -> tuple:
+    """Pixel size of a maze cell, without a tile size the whole maze is fitted to the screen."""
+    if tile_size is None:
+        return (screen_width//map_width, screen_height//map_height)
+    return (tile_size, tile_size)
\ No newline at end of file
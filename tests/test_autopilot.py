@@ -0,0 +1,84 @@
+import random
+from collections import deque
+import pytest
+import autopilot
+from autopilot import Autopilot, _Search
+from engine import Engine
+from utils import MOVE_BITS
+
+def bfs_length(grid, start: int, goal: int):
+    '''Steps of the shortest path between two flat cell ids, None if there is none.'''
+    width, height = grid.shape
+    distance = {start: 0}
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        if cell == goal:
+            return distance[cell]
+        x, y = divmod(cell, height)
+        for nx, ny in ((x, y-1), (x, y+1), (x-1, y), (x+1, y)):
+            neighbor = nx*height + ny
+            if 0 <= nx < width and 0 <= ny < height and grid[nx, ny] == 0 and neighbor not in distance:
+                distance[neighbor] = distance[cell] + 1
+                queue.append(neighbor)
+    return None
+
+def open_cells(grid):
+    height = grid.shape[1]
+    return [x*height + y for x, y in zip(*(grid == 0).nonzero())]
+
+@pytest.mark.parametrize("seed", range(3))
+def test_cached_paths_are_shortest(seed):
+    state = Engine(60, 30, 0.3, 100, 100, 10).reset(seed)
+    pilot = Autopilot()
+    pilot(state)
+    cells = open_cells(state.grid)
+    rng = random.Random(seed)
+    # Few goals, so later searches finish along cached routes
+    goals = cells[:5]
+    for _ in range(200):
+        start, goal = rng.choice(cells), rng.choice(goals)
+        path = pilot.path(start, goal)
+        length = bfs_length(state.grid, start, goal)
+        if length is None:
+            assert path is None
+            continue
+        assert path[0] == start and path[-1] == goal
+        assert len(path) - 1 == length
+        steps = [(divmod(cell, 30), divmod(next_cell, 30)) for cell, next_cell in zip(path, path[1:])]
+        assert all(abs(x - nx) + abs(y - ny) == 1 for (x, y), (nx, ny) in steps)
+        assert all(state.grid.flat[cell] == 0 for cell in path)
+
+def test_search_in_steps_matches_full_search():
+    state = Engine(80, 40, 0.3, 100, 100, 10).reset(1)
+    pilot = Autopilot()
+    pilot(state)
+    cells = open_cells(state.grid)
+    rng = random.Random(0)
+    for _ in range(100):
+        start, goal = rng.choice(cells), rng.choice(cells)
+        full = _Search(state.move_mask, pilot._offsets, start, goal)
+        assert full.run()
+        stepped = _Search(state.move_mask, pilot._offsets, start, goal)
+        while not stepped.run(rng.randint(0, 5)):
+            pass
+        assert stepped.path == full.path
+        assert stepped.expansions == full.expansions
+
+@pytest.mark.parametrize("plan_expansions", [5, autopilot.PLAN_EXPANSIONS])
+def test_moves_stay_legal_with_dynamic_walls(monkeypatch, plan_expansions):
+    monkeypatch.setattr(autopilot, "PLAN_EXPANSIONS", plan_expansions)
+    engine = Engine(60, 30, 0.2, 100, 100, 10**6, dynamic_walls=True)
+    state = engine.reset(3)
+    pilot = Autopilot(random.Random(0))
+    score = 0
+    for tick in range(1500):
+        action = pilot(state)
+        if action is not None:
+            assert state.move_mask[state.pacman.x, state.pacman.y] & MOVE_BITS[action]
+        state, _ = engine.step(action)
+        score = max(score, state.score)
+        if not state.running:
+            state = engine.reset(tick)
+    # Searches spread over ticks still get pacman to the dots
+    assert score > 0
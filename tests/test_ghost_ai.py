@@ -0,0 +1,99 @@
+import random
+from collections import deque
+import numpy as np
+import pytest
+from maze_generator import generate_maze
+from ghost_ai import GHOST_STEPS, VECTORIZE_FROM, GhostPlanner
+
+def bfs_distances(grid: np.ndarray, target) -> np.ndarray:
+    '''Steps from target to every cell with a plain BFS, grid.size where it cannot be reached.'''
+    width, height = grid.shape
+    distance = np.full(grid.shape, grid.size, dtype=np.int64)
+    distance[target] = 0
+    queue = deque([target])
+    while queue:
+        x, y = queue.popleft()
+        for dx, dy in GHOST_STEPS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < width and 0 <= ny < height and grid[nx, ny] == 0 and distance[nx, ny] == grid.size:
+                distance[nx, ny] = distance[x, y] + 1
+                queue.append((nx, ny))
+    return distance
+
+def reference_moves(grid: np.ndarray, xs, ys, target, mode: str, rng: np.random.Generator) -> np.ndarray:
+    '''The planner's rules written out: a full BFS field and one ghost at a time.'''
+    width, height = grid.shape
+    distance = bfs_distances(grid, target)
+    moves = []
+    for x, y, pick in zip(xs, ys, rng.random(len(xs))):
+        weights = []
+        for dx, dy in GHOST_STEPS:
+            nx, ny = x + dx, y + dy
+            if not (0 <= nx < width and 0 <= ny < height) or grid[nx, ny] != 0:
+                weights.append(0)
+            elif mode == 'hunt':
+                weights.append(3 if distance[nx, ny] < distance[x, y] else 1)
+            elif mode == 'fear':
+                weights.append(3 if distance[nx, ny] > distance[x, y] else 1)
+            else:
+                weights.append(1)
+        move = (0, 0)
+        cumulative = 0
+        for step, weight in zip(GHOST_STEPS, weights):
+            cumulative += weight
+            if cumulative > pick*sum(weights):
+                move = step
+                break
+        moves.append(move)
+    return np.array(moves).reshape(len(moves), 2)
+
+@pytest.mark.parametrize("size", [(31, 17), (60, 30), (120, 80)])
+def test_moves_match_reference(size):
+    grid = generate_maze(size[0], size[1], 0.3, 0.1, 0.5, random.Random(sum(size)))
+    planner = GhostPlanner(grid)
+    cells = np.argwhere(grid == 0)
+    rng = random.Random(0)
+    # Few targets, so cached searches are continued and read back
+    targets = [tuple(cells[rng.randrange(len(cells))].tolist()) for _ in range(8)]
+    for tick in range(150):
+        count = rng.choice([1, 3, VECTORIZE_FROM - 1, VECTORIZE_FROM, 200])
+        ghosts = cells[[rng.randrange(len(cells)) for _ in range(count)]]
+        xs, ys = ghosts[:, 0].tolist(), ghosts[:, 1].tolist()
+        target = rng.choice(targets)
+        mode = rng.choice(['hunt', 'calm', 'fear'])
+        expected = reference_moves(grid, xs, ys, target, mode, np.random.default_rng(tick))
+        moves = planner.next_moves(xs, ys, target, mode, np.random.default_rng(tick))
+        assert np.array_equal(moves, expected), (tick, count, mode)
+
+def test_moves_match_reference_while_walls_change():
+    grid = generate_maze(40, 25, 0.3, 0.1, 0.5, random.Random(7))
+    planner = GhostPlanner(grid)
+    rng = random.Random(1)
+    targets = [tuple(cell.tolist()) for cell in np.argwhere(grid == 0)[:5]]
+    for tick in range(300):
+        x, y = rng.randrange(grid.shape[0]), rng.randrange(grid.shape[1])
+        if (x, y) not in targets:
+            grid[x, y] ^= 1
+            planner.update_cell(grid, x, y)
+        cells = np.argwhere(grid == 0)
+        ghosts = cells[[rng.randrange(len(cells)) for _ in range(rng.choice([2, 50]))]]
+        xs, ys = ghosts[:, 0].tolist(), ghosts[:, 1].tolist()
+        target = rng.choice(targets)
+        mode = rng.choice(['hunt', 'fear'])
+        expected = reference_moves(grid, xs, ys, target, mode, np.random.default_rng(tick))
+        moves = planner.next_moves(xs, ys, target, mode, np.random.default_rng(tick))
+        assert np.array_equal(moves, expected), tick
+
+def test_full_distance_field_matches_bfs():
+    grid = generate_maze(60, 30, 0.3, 0.1, 0.5, random.Random(3))
+    planner = GhostPlanner(grid)
+    for cell in np.argwhere(grid == 0)[::97]:
+        target = tuple(cell.tolist())
+        assert np.array_equal(planner.distance_field(target).reshape(grid.shape), bfs_distances(grid, target))
+
+def test_cache_is_bounded_by_bytes():
+    grid = generate_maze(60, 30, 0.3, 0.1, 0.5, random.Random(3))
+    planner = GhostPlanner(grid, cache_bytes=20*8*grid.size)
+    for cell in np.argwhere(grid == 0)[:100]:
+        planner.distance_field(tuple(cell.tolist()), [int(cell[0])*grid.shape[1] + int(cell[1])])
+    assert len(planner._cache) == 20
@@ -0,0 +1,93 @@
+import heapq
+import random
+from collections import deque
+import numpy as np
+import pytest
+from maze_generator import Maze, generate_maze
+
+def bfs_components(grid) -> int:
+    '''Number of open areas, counted with a plain BFS.'''
+    rows, cols = len(grid), len(grid[0])
+    seen = set()
+    count = 0
+    for r in range(rows):
+        for c in range(cols):
+            if grid[r][c] or (r, c) in seen:
+                continue
+            count += 1
+            seen.add((r, c))
+            queue = deque([(r, c)])
+            while queue:
+                cr, cc = queue.popleft()
+                for nr, nc in ((cr+1, cc), (cr-1, cc), (cr, cc+1), (cr, cc-1)):
+                    if 0 <= nr < rows and 0 <= nc < cols and not grid[nr][nc] and (nr, nc) not in seen:
+                        seen.add((nr, nc))
+                        queue.append((nr, nc))
+    return count
+
+def fewest_walls_between(grid, sources, targets) -> int:
+    '''Walls on the cheapest path from sources to targets, with Dijkstra.'''
+    rows, cols = len(grid), len(grid[0])
+    dist = {cell: 0 for cell in sources}
+    heap = [(0, cell) for cell in sources]
+    while heap:
+        d, (r, c) = heapq.heappop(heap)
+        if (r, c) in targets:
+            return d
+        if d > dist[(r, c)]:
+            continue
+        for nr, nc in ((r+1, c), (r-1, c), (r, c+1), (r, c-1)):
+            if 0 <= nr < rows and 0 <= nc < cols and d + grid[nr][nc] < dist.get((nr, nc), rows*cols):
+                dist[(nr, nc)] = d + grid[nr][nc]
+                heapq.heappush(heap, (dist[(nr, nc)], (nr, nc)))
+    raise AssertionError("targets not reachable")
+
+def random_maze(rows, cols, density, seed) -> Maze:
+    rng = random.Random(seed)
+    maze = Maze(rows, cols, density, 0.5, rng)
+    maze.grid = [[int(rng.random() < density) for _ in range(cols)] for _ in range(rows)]
+    return maze
+
+@pytest.mark.parametrize("seed", range(30))
+def test_label_components_matches_bfs(seed):
+    maze = random_maze(15, 20, 0.45, seed)
+    labels, count = maze.label_components()
+    assert count == bfs_components(maze.grid)
+    for r in range(maze.rows):
+        for c in range(maze.cols):
+            assert (labels[r][c] == -1) == (maze.grid[r][c] == 1)
+
+@pytest.mark.parametrize("seed", range(30))
+def test_connect_components_only_opens_walls(seed):
+    maze = random_maze(15, 20, 0.55, seed)
+    before = [row[:] for row in maze.grid]
+    opened = maze.connect_components()
+    assert bfs_components(maze.grid) <= 1
+    changed = [(r, c) for r in range(maze.rows) for c in range(maze.cols) if before[r][c] != maze.grid[r][c]]
+    assert len(changed) == opened
+    assert all(before[r][c] == 1 for r, c in changed)
+
+@pytest.mark.parametrize("seed", range(30))
+def test_two_areas_are_joined_through_fewest_walls(seed):
+    rng = random.Random(seed)
+    rows, cols = 12, 16
+    maze = Maze(rows, cols, 0.5, 0.5, rng)
+    maze.grid = [[1]*cols for _ in range(rows)]
+    # A larger area on the left and a smaller one on the right
+    top, left = rng.randrange(rows - 3), rng.randrange(cols//3)
+    large = {(r, c) for r in range(top, top + 3) for c in range(left, left + 3)}
+    top, left = rng.randrange(rows - 2), rng.randrange(cols//2 + 2, cols - 1)
+    small = {(r, c) for r in range(top, top + 2) for c in range(left, left + 2)}
+    for r, c in large | small:
+        maze.grid[r][c] = 0
+    walls = [row[:] for row in maze.grid]
+    assert maze.connect_components() == fewest_walls_between(walls, large, small)
+    assert bfs_components(maze.grid) == 1
+
+@pytest.mark.parametrize("size", [(30, 20), (60, 30), (200, 150)])
+def test_generated_mazes_are_connected(size):
+    rng = random.Random(sum(size))
+    for _ in range(3):
+        grid = generate_maze(size[0], size[1], 0.3, 0.1, 0.5, rng)
+        assert grid.dtype == np.uint8
+        assert bfs_components(grid.tolist()) == 1